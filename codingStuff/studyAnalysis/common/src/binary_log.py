@@ -0,0 +1,111 @@
+"""
+Fixed width binary format for oEDataTracker recordings.
+
+A file starts with a 16 byte header (magic b'OEDT', uint16 format version, uint16 record size, uint16 number of
+MLX sensors, 6 reserved bytes) followed by packed little-endian records of 66 bytes:
+
+    int16  ID
+    uint32 TIMESTAMP                  millis() of the sample
+    int16  6 x temperature            get_Temp() * 100, 0 if the sensor was not read
+    int16  6 x sensor temperature     get_sensor_temp() * 100, 0 if the sensor was not read
+    int32  9 x IMU                    ACC, GYRO, MAG * 10000
+
+The column names are the ones of the CSV header, so both formats load into the same DataFrame.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.src.sd_log_reader import SD_LOG_COLUMNS, read_sd_log
+
+BINARY_LOG_SUFFIX = '.oebin'
+MAGIC = b'OEDT'
+FORMAT_VERSION = 1
+N_SENSORS = 6
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u2'),
+    ('record_size', '<u2'),
+    ('n_sensors', '<u2'),
+    ('reserved', 'V6'),
+])
+RECORD_DTYPE = np.dtype(
+    [('ID', '<i2'), ('TIMESTAMP', '<u4')]
+    + [(col, '<i2') for col in SD_LOG_COLUMNS[2:2 + 2 * N_SENSORS]]
+    + [(col, '<i4') for col in SD_LOG_COLUMNS[2 + 2 * N_SENSORS:]]
+)
+
+
+def is_binary_log(file_path):
+    return file_path.endswith(BINARY_LOG_SUFFIX)
+
+
+def open_binary_log(file_path):
+    """Maps the records of a binary log as a read-only numpy structured array without reading them"""
+    header = np.fromfile(file_path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != MAGIC:
+        raise ValueError(f"{file_path} is not an oEDataTracker binary log")
+    if header['version'][0] != FORMAT_VERSION or header['record_size'][0] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{file_path} has unsupported format version {header['version'][0]}")
+
+    # A record which was only partly written before a reset is ignored
+    n_records = (os.path.getsize(file_path) - HEADER_DTYPE.itemsize) // RECORD_DTYPE.itemsize
+    if n_records == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(file_path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(n_records,))
+
+
+def records_to_dataframe(records):
+    """
+    DataFrame whose columns are strided views of the records, so a mapped log is only paged in where it is read.
+    The columns keep the record types, e.g. int16 ID and uint32 TIMESTAMP, a cast would copy them.
+    """
+    return pd.DataFrame({name: records[name] for name in RECORD_DTYPE.names}, copy=False)
+
+
+def write_binary_log(file_path, records):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = FORMAT_VERSION
+    header['record_size'] = RECORD_DTYPE.itemsize
+    header['n_sensors'] = N_SENSORS
+    with open(file_path, 'wb') as file:
+        file.write(header.tobytes())
+        file.write(np.ascontiguousarray(records, dtype=RECORD_DTYPE).tobytes())
+
+
+def convert_csv_to_binary(csv_path, binary_path=None):
+    """Converts a CSV log written by SD_Logger into the binary format, returns the path of the binary log"""
+    if binary_path is None:
+        binary_path = os.path.splitext(csv_path)[0] + BINARY_LOG_SUFFIX
+
+    log = read_sd_log(csv_path)
+    if log.columns != SD_LOG_COLUMNS:
+        raise ValueError(f"{csv_path} does not have the oEDataTracker columns")
+
+    records = np.zeros(len(log.data), dtype=RECORD_DTYPE)
+    for i, name in enumerate(RECORD_DTYPE.names):
+        column = log.data[:, i]
+        info = np.iinfo(RECORD_DTYPE[name])
+        if len(column) and (column.min() < info.min or column.max() > info.max):
+            raise ValueError(f"Column {name} of {csv_path} does not fit into {RECORD_DTYPE[name]}")
+        records[name] = column
+
+    write_binary_log(binary_path, records)
+    return binary_path
+
+
+def select_log_files(file_names):
+    """Returns the log files among file_names, a binary log replaces the CSV it was converted from"""
+    binary_stems = {os.path.splitext(name)[0] for name in file_names if is_binary_log(name)}
+    return [name for name in file_names
+            if is_binary_log(name) or (name.endswith('.csv') and os.path.splitext(name)[0] not in binary_stems)]
+
+
+def iter_binary_log(file_path, chunk_rows):
+    """Yields the records of a binary log as DataFrames of at most chunk_rows rows"""
+    records = open_binary_log(file_path)
+    for start in range(0, len(records), chunk_rows):
+        yield records_to_dataframe(records[start:start + chunk_rows])
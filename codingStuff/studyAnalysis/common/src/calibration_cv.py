@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from common.src.calibration_metrics import calibration_metrics
+from common.src.parallel import map_ordered
+from common.src.polynomial_fit import PolynomialFit
+
+
+def calibrate_methods(fit_values, fit_target, values, degrees):
+    """
+    Constant offset, linear and polynomial calibrations fitted on (fit_values, fit_target) and applied to values,
+    as a dict of method name to (n_samples x n_sensors) arrays. The names match CalibrationPipeline.
+    """
+    offsets = np.nanmean(fit_target) - np.nanmean(fit_values, axis=0)
+    fit = PolynomialFit(fit_values, fit_target, max(degrees))
+    methods = {'Constant': values + offsets, 'Linear': fit.evaluate(values, 1)}
+    for degree in degrees:
+        methods[f'Poly_{degree}'] = fit.evaluate(values, degree)
+    return methods
+
+
+def evaluate_fold(fold, fit_values, fit_target, test_values, test_target, degrees, sensors):
+    """Fits every method on the fit rows and evaluates it on the held-out rows"""
+    methods = calibrate_methods(fit_values, fit_target, test_values, degrees)
+    table = calibration_metrics(test_target, np.stack(list(methods.values())), methods.keys(), sensors)
+    table.insert(0, 'Fold', fold)
+    return table
+
+
+def leave_one_group_out(values, target, groups, degrees, sensors, num_workers=1):
+    """
+    Held-out metrics of every method and sensor with each group (e.g. one recording) left out once, as one table
+    indexed by (Method, Sensor) with a Fold column. Folds run in num_workers processes, each fold is one batched
+    fit, so all folds take about as long as one fit per core. A failed fold raises, a summary without it would
+    look complete.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    groups = np.asarray(groups)
+    jobs = []
+    for fold in pd.unique(groups):
+        # The job carries its fit and held-out rows already sliced, no full-length mask next to the whole dataset
+        test_rows = groups == fold
+        jobs.append((fold, values[~test_rows], target[~test_rows], values[test_rows], target[test_rows],
+                     degrees, sensors))
+    return pd.concat(map_ordered(evaluate_fold, jobs, num_workers, skip_errors=False))
+
+
+def summarize_folds(fold_metrics):
+    """Mean of every metric over the folds, per method and sensor and per method"""
+    metrics = fold_metrics.drop(columns=['Fold'])
+    by_sensor = metrics.groupby(level=['Method', 'Sensor'], sort=False).mean()
+    by_method = metrics.groupby(level='Method', sort=False).mean()
+    return by_sensor, by_method
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+METRIC_COLUMNS = ['n', 'MAE', 'RMSE', 'Max_Error', 'Error_Variance', 'Correlation']
+
+
+def calibration_metrics(target, calibrated, methods, sensors, mask=None):
+    """
+    MAE, RMSE, maximum absolute error, error variance (ddof=0) and Pearson correlation of every method and sensor
+    against the target, as one table indexed by (Method, Sensor). calibrated is (n_methods x n_samples x n_sensors)
+    and is evaluated in one pass over the rows where the target and every calibrated value are valid, so all
+    methods and sensors are compared on the same samples.
+    """
+    target = np.asarray(target, dtype=np.float64)
+    calibrated = np.asarray(calibrated, dtype=np.float64)
+    if mask is None:
+        mask = np.isfinite(target) & np.isfinite(calibrated).all(axis=(0, 2))
+    target = target[mask]
+    calibrated = calibrated[:, mask, :]
+
+    errors = calibrated - target[None, :, None]
+    absolute_errors = np.abs(errors)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centered = calibrated - calibrated.mean(axis=1, keepdims=True)
+        centered_target = target - target.mean()
+        correlation = (np.einsum('msk,s->mk', centered, centered_target)
+                       / np.sqrt((centered ** 2).sum(axis=1) * (centered_target ** 2).sum()))
+        table = {
+            'n': np.full(errors.shape[0] * errors.shape[2], len(target)),
+            'MAE': absolute_errors.mean(axis=1).ravel(),
+            'RMSE': np.sqrt((errors ** 2).mean(axis=1)).ravel(),
+            'Max_Error': absolute_errors.max(axis=1, initial=0.0).ravel(),
+            'Error_Variance': errors.var(axis=1).ravel(),
+            'Correlation': correlation.ravel(),
+        }
+    index = pd.MultiIndex.from_product([list(methods), list(sensors)], names=['Method', 'Sensor'])
+    return pd.DataFrame(table, index=index)[METRIC_COLUMNS]
@@ -0,0 +1,92 @@
+import json
+import warnings
+
+import numpy as np
+
+
+class CalibrationModel:
+    """
+    One calibration method of a fit_parameters.json from the CalibrationPipeline, compiled into a coefficient
+    matrix (terms x sensors) so a whole (time x sensor) array is calibrated in one vectorized pass. 'Constant' and
+    'Linear' are evaluated with Horner's scheme. 'Poly_<degree>' uses the Chebyshev form of the file, the
+    authoritative one, with Clenshaw's recurrence, the Horner analogue for Chebyshev series. Only files without it
+    fall back to the legacy np.polyfit coefficients, whose raw powers of °C lose precision at high degrees. NaN
+    stays NaN.
+    """
+
+    def __init__(self, parameters, method='Linear'):
+        self.method = method
+        self.kind = 'power'
+        self.domains = None
+
+        if method == 'Constant':
+            offsets = parameters['precomputed_offsets']
+            self.columns = list(offsets)
+            self.coefficients = np.array([[1.0] * len(offsets), list(offsets.values())])
+        elif method == 'Linear':
+            linear = parameters['precomputed_params']
+            self.columns = list(linear)
+            self.coefficients = np.array([[linear[col]['Slope'] for col in self.columns],
+                                          [linear[col]['Intercept'] for col in self.columns]])
+        elif method.startswith('Poly_'):
+            degree = method[len('Poly_'):]
+            chebyshev = parameters.get('chebyshev', {}).get(degree)
+            if chebyshev is not None:
+                self.kind = 'chebyshev'
+                self.columns = list(chebyshev)
+                self.domains = np.array([chebyshev[col]['domain'] for col in self.columns]).T
+                # Highest order first like the power form, so both recurrences walk the rows in the same order
+                self.coefficients = np.array([chebyshev[col]['coefficients'][::-1] for col in self.columns]).T
+            else:
+                # Files from before the Chebyshev export, their raw powers drift at high degrees
+                warnings.warn(f"Using the legacy power coefficients of {method}, inaccurate at high degrees",
+                              UserWarning, stacklevel=2)
+                polynomial = parameters['coefficients'][degree]
+                self.columns = list(polynomial)
+                self.coefficients = np.array([polynomial[col] for col in self.columns]).T
+        else:
+            raise ValueError(f"Unknown calibration method {method!r}")
+
+    @classmethod
+    def from_json(cls, json_path, method=None):
+        # By default the method the CalibrationPipeline selected by held-out error, Linear for older files
+        with open(json_path) as file:
+            parameters = json.load(file)
+        return cls(parameters, method or parameters.get('selected_method', 'Linear'))
+
+    def select(self, columns):
+        """Coefficient columns (and domains) in the order of the given sensors"""
+        missing = [col for col in columns if col not in self.columns]
+        if missing:
+            raise ValueError(f"No {self.method} calibration for {missing}")
+        order = [self.columns.index(col) for col in columns]
+        return self.coefficients[:, order], None if self.domains is None else self.domains[:, order]
+
+    def apply(self, values, columns=None, dtype=np.float64):
+        """
+        Calibrated copy of a (time x sensor) array whose columns are the given sensors (all sensors of the model
+        by default). dtype=np.float32 halves the memory traffic of long recordings.
+        """
+        coefficients, domains = self.select(self.columns if columns is None else list(columns))
+        coefficients = coefficients.astype(dtype)
+        values = np.asarray(values, dtype=dtype)
+
+        if self.kind == 'power':
+            result = np.full(values.shape, coefficients[0], dtype=dtype)
+            for coefficient in coefficients[1:]:
+                result *= values
+                result += coefficient
+            return result
+
+        low, high = domains.astype(dtype)
+        scaled = (2 * values - (low + high)) / (high - low)
+        b1 = np.zeros_like(scaled)
+        b2 = np.zeros_like(scaled)
+        for coefficient in coefficients[:-1]:
+            b1, b2 = 2 * scaled * b1 - b2 + coefficient, b1
+        return scaled * b1 - b2 + coefficients[-1]
+
+    def apply_frame(self, df, columns, dtype=np.float64):
+        """Replaces the temperature columns of df with their calibrated values"""
+        df[columns] = self.apply(df[columns].to_numpy(dtype=dtype), columns, dtype)
+        return df
@@ -0,0 +1,36 @@
+import numpy as np
+from scipy.stats import rankdata
+
+# Largest |r| averaged in Fisher z space, arctanh(0.999) = 3.8
+MAX_ABS_CORRELATION = 0.999
+
+
+def correlation_matrix(values, method='spearman'):
+    """
+    All pairwise Pearson or Spearman correlations between the columns of an (n_samples x n_columns) array without
+    NaN. Every column is ranked once and the matrix comes from one matrix product. Columns without variance give
+    NaN, like scipy does.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if method == 'spearman':
+        values = rankdata(values, axis=0) if len(values) else values
+    elif method != 'pearson':
+        raise ValueError(f"Unknown correlation method {method!r}")
+
+    centered = values - values.mean(axis=0) if len(values) else values
+    norms = np.sqrt((centered ** 2).sum(axis=0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normalized = centered / norms
+    matrix = normalized.T @ normalized
+    matrix[:, norms == 0] = np.nan
+    matrix[norms == 0, :] = np.nan
+    return np.clip(matrix, -1.0, 1.0)
+
+
+def fisher_z_mean(correlations, axis=0, max_abs=MAX_ABS_CORRELATION):
+    """
+    Averages correlations in Fisher z space, NaN propagates like np.mean. |r| is clipped to max_abs first: |r| = 1
+    would be an infinite z value, and one close to it would outweigh every other entry of the average.
+    """
+    z_values = np.arctanh(np.clip(correlations, -max_abs, max_abs))
+    return np.tanh(np.mean(z_values, axis=axis))
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+class DenseTemperatures:
+    """Temperatures of the round-robin read MLX sensors, one row per read cycle and one column per sensor"""
+
+    def __init__(self, values, timestamps, cycle_timestamps, cycle_ids, columns):
+        self.values = values  # (n_cycles x n_sensors) float32, NaN where a sensor was not read in a cycle
+        self.timestamps = timestamps  # (n_cycles x n_sensors) time at which each value was read
+        self.cycle_timestamps = cycle_timestamps  # mean read time of each cycle
+        self.cycle_ids = cycle_ids  # phase ID at the start of each cycle
+        self.columns = list(columns)
+
+    def __len__(self):
+        return len(self.values)
+
+    def select(self, mask):
+        return DenseTemperatures(self.values[mask], self.timestamps[mask], self.cycle_timestamps[mask],
+                                 self.cycle_ids[mask], self.columns)
+
+    def phase(self, phase_id):
+        return self.select(self.cycle_ids == phase_id)
+
+    def to_dataframe(self):
+        df = pd.DataFrame(self.values, columns=self.columns)
+        df.insert(0, 'TIMESTAMP', self.cycle_timestamps)
+        df.insert(0, 'ID', self.cycle_ids)
+        return df
+
+
+def deinterleave(temperatures, timestamps, ids=None, columns=None, max_gap=None):
+    """
+    Packs the rows written by oEDataTracker, where only the sensor at the current position of the read cycle
+    holds a value and all others are 0 (or NaN), into one dense row per read cycle.
+
+    A new cycle starts whenever a sensor position is not behind the previous one, so cycles which start at an
+    arbitrary sensor or miss single reads stay aligned. Rows which hold all sensors at once (older firmware)
+    become one cycle each. Cycles are also split at phase changes and, if max_gap is given, at time gaps
+    larger than max_gap.
+    """
+    temperatures = np.asarray(temperatures)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if ids is None:
+        ids = np.zeros(len(temperatures), dtype=np.int32)
+    ids = np.asarray(ids)
+    if columns is None:
+        columns = [f"Sensor{i}" for i in range(temperatures.shape[1])]
+
+    valid = np.isfinite(temperatures) & (temperatures != 0)
+    rows, slots = np.nonzero(valid)  # row-major, so samples stay in recording order
+
+    new_cycle = np.ones(len(rows), dtype=bool)
+    new_cycle[1:] = slots[1:] <= slots[:-1]
+    sample_ids = ids[rows]
+    new_cycle[1:] |= sample_ids[1:] != sample_ids[:-1]
+    sample_timestamps = timestamps[rows]
+    if max_gap is not None:
+        new_cycle[1:] |= np.diff(sample_timestamps) > max_gap
+
+    cycle = np.cumsum(new_cycle) - 1
+    n_cycles = int(cycle[-1]) + 1 if len(cycle) else 0
+    n_sensors = temperatures.shape[1]
+
+    values = np.full((n_cycles, n_sensors), np.nan, dtype=np.float32)
+    values[cycle, slots] = temperatures[rows, slots]
+    dense_timestamps = np.full((n_cycles, n_sensors), np.nan)
+    dense_timestamps[cycle, slots] = sample_timestamps
+
+    counts = np.bincount(cycle, minlength=n_cycles)
+    cycle_timestamps = np.bincount(cycle, weights=sample_timestamps, minlength=n_cycles) / np.maximum(counts, 1)
+    cycle_ids = sample_ids[new_cycle]
+
+    return DenseTemperatures(values, dense_timestamps, cycle_timestamps, cycle_ids, columns)
+
+
+def deinterleave_frame(df, temp_columns, max_gap=None):
+    return deinterleave(df[temp_columns].to_numpy(), df['TIMESTAMP'].to_numpy(), df['ID'].to_numpy(),
+                        temp_columns, max_gap)
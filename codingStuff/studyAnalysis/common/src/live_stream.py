@@ -0,0 +1,205 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from common.src.log_cache import TEMP_COLUMNS
+from common.src.sd_log_reader import SD_LOG_COLUMNS
+from common.src.temperature_stream import iter_log_blocks
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+# print_data in oEDataTracker prints these lines for every sample in debug mode
+DEBUG_TEMPERATURE_PREFIX = 'Object Temperature:'
+BAUDRATE = 115200
+
+
+def serial_lines(port, baudrate=BAUDRATE, timeout=1.0):
+    """Lines of text from the earable's serial port (needs pyserial), until the port closes"""
+    if serial is None:
+        raise ImportError("Reading from a serial port needs pyserial (pip install pyserial)")
+    with serial.Serial(port, baudrate, timeout=timeout) as connection:
+        while connection.is_open:
+            line = connection.readline()
+            if line:
+                yield line.decode('ascii', errors='replace')
+
+
+def tail_lines(file_path, poll_interval=0.1, idle_timeout=None):
+    """
+    Complete lines of a file while it is being appended to, like tail -f from the start of the file. A half
+    written last line is held back until its line end arrives. Stops after idle_timeout seconds without new data,
+    never if None.
+    """
+    with open(file_path, 'r', newline='') as file:
+        partial = ''
+        idle_since = time.monotonic()
+        while True:
+            chunk = file.readline()
+            if chunk:
+                idle_since = time.monotonic()
+                partial += chunk
+                if partial.endswith(('\n', '\r')):
+                    yield partial
+                    partial = ''
+                continue
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                return
+            time.sleep(poll_interval)
+
+
+def to_temperatures(raw_values):
+    """Firmware integers (°C x 100, 0 for a sensor not read in this sample) to °C with NaN"""
+    values = np.asarray(raw_values, dtype=np.float64) / 100.0
+    values[values == 0] = np.nan
+    return values
+
+
+def parse_debug_lines(lines, clock=time.monotonic):
+    """
+    Samples (timestamp in ms, temperatures in °C) from the debug output of print_data. The debug output has no
+    time stamp, the time of arrival on clock is used.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line.startswith(DEBUG_TEMPERATURE_PREFIX):
+            continue
+        try:
+            raw_values = [int(value) for value in line[len(DEBUG_TEMPERATURE_PREFIX):].split(',')]
+        except ValueError:
+            continue  # garbled line, e.g. after reconnecting mid-line
+        yield clock() * 1000.0, to_temperatures(raw_values)
+
+
+def parse_log_lines(lines, n_temperatures=len(TEMP_COLUMNS)):
+    """Samples (timestamp in ms, temperatures in °C) from lines in the SD_Logger CSV layout, header lines skipped"""
+    n_columns = len(SD_LOG_COLUMNS)
+    for line in lines:
+        fields = line.strip().split(',')
+        if len(fields) != n_columns:
+            continue
+        try:
+            row = [int(field) for field in fields]
+        except ValueError:
+            continue  # header
+        if row[0] == -1:
+            return  # terminator row written when the measurement was stopped
+        yield float(row[1]), to_temperatures(row[2:2 + n_temperatures])
+
+
+def replay_log(file_path, speed=1.0, temp_columns=TEMP_COLUMNS, sleep=time.sleep):
+    """
+    Samples (timestamp in ms, temperatures in °C) of a recorded CSV or binary log, paced like the recording at
+    speed times real time. speed=None replays as fast as possible.
+    """
+    start_wall = None
+    start_timestamp = None
+    for block in iter_log_blocks(file_path, temp_columns):
+        timestamps = block['TIMESTAMP'].to_numpy(dtype=np.float64)
+        values = block[list(temp_columns)].to_numpy(dtype=np.float64)
+        for timestamp, sample in zip(timestamps, values):
+            if speed is not None:
+                if start_wall is None:
+                    start_wall, start_timestamp = time.monotonic(), timestamp
+                delay = start_wall + (timestamp - start_timestamp) / 1000.0 / speed - time.monotonic()
+                if delay > 0:
+                    sleep(delay)
+            yield timestamp, sample
+
+
+def open_source(source, follow=False, replay_speed=1.0, idle_timeout=None):
+    """
+    Samples of a serial port (e.g. /dev/ttyACM0 or COM3) or of a log file. A file is replayed at replay_speed, or
+    with follow=True read while it is being written.
+    """
+    if not os.path.isfile(source):
+        return parse_debug_lines(serial_lines(source))
+    if follow:
+        return parse_log_lines(tail_lines(source, idle_timeout=idle_timeout))
+    return replay_log(source, replay_speed)
+
+
+class MovingAverage:
+    """Mean of the last window valid values of every channel, updated in O(1) per sample with ring buffers"""
+
+    def __init__(self, n_channels, window):
+        self.window = window
+        self.buffer = np.full((window, n_channels), np.nan)
+        self.position = np.zeros(n_channels, dtype=np.int64)
+        self.sums = np.zeros(n_channels)
+        self.counts = np.zeros(n_channels, dtype=np.int64)
+
+    def update(self, values):
+        channels = np.flatnonzero(np.isfinite(values))
+        slots = self.position[channels] % self.window
+        old = self.buffer[slots, channels]
+        replaced = np.isfinite(old)
+        self.sums[channels] += values[channels] - np.where(replaced, old, 0.0)
+        self.counts[channels] += ~replaced
+        self.buffer[slots, channels] = values[channels]
+        self.position[channels] += 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.counts
+
+
+class OnlineTemperatureEstimator:
+    """
+    Core temperature estimate from a live sample stream. Every sample carries the round-robin read sensors, the
+    others are NaN. Each reading is calibrated, smoothed per sensor over its last smoothing_window readings (20
+    readings of each of six sensors correspond to the 120 rows smooth_data uses offline) and the sensors are fused
+    into one estimate. A sensor whose last reading is older than max_age_ms is left out of the fusion. Every sample
+    costs O(1) and is answered at once, the smoothing delays the estimate by (smoothing_window - 1) / 2 readings.
+    """
+
+    def __init__(self, temp_columns=TEMP_COLUMNS, calibration=None, smoothing_window=20, max_age_ms=2000.0,
+                 weights=None):
+        self.temp_columns = list(temp_columns)
+        self.calibration = calibration
+        self.max_age_ms = max_age_ms
+        self.smoother = MovingAverage(len(self.temp_columns), smoothing_window)
+        self.last_read = np.full(len(self.temp_columns), -np.inf)
+        self.weights = np.ones(len(self.temp_columns)) if weights is None else \
+            np.array([weights.get(col, 0.0) for col in self.temp_columns], dtype=np.float64)
+
+    def update(self, timestamp, values):
+        """Estimate after one sample as a dict with TIMESTAMP, the smoothed sensors and the fused 'estimate'"""
+        values = np.asarray(values, dtype=np.float64)
+        if self.calibration is not None:
+            values = self.calibration.apply(values[None, :], self.temp_columns)[0]
+        self.last_read[np.isfinite(values)] = timestamp
+
+        smoothed = self.smoother.update(values)
+        fresh = np.isfinite(smoothed) & (timestamp - self.last_read <= self.max_age_ms)
+        estimate = self.fuse(smoothed, fresh)
+
+        result = dict(zip(self.temp_columns, smoothed))
+        result['TIMESTAMP'] = timestamp
+        result['estimate'] = estimate
+        return result
+
+    def fuse(self, smoothed, fresh):
+        weights = np.where(fresh, self.weights, 0.0)
+        total = weights.sum()
+        return np.dot(weights, np.where(fresh, smoothed, 0.0)) / total if total > 0 else np.nan
+
+    def run(self, samples):
+        """Yields an estimate for every (timestamp, temperatures) sample"""
+        for timestamp, values in samples:
+            yield self.update(timestamp, values)
+
+    def collect(self, samples):
+        return pd.DataFrame(list(self.run(samples)), columns=['TIMESTAMP'] + self.temp_columns + ['estimate'])
+
+
+if __name__ == '__main__':
+    # python -m common.src.live_stream <serial port or log file> [fit_parameters.json], log files are replayed
+    import sys
+    from common.src.calibration_model import CalibrationModel
+
+    model = CalibrationModel.from_json(sys.argv[2]) if len(sys.argv) > 2 else None
+    for result in OnlineTemperatureEstimator(calibration=model).run(open_source(sys.argv[1])):
+        print(f"{result['TIMESTAMP']:.0f} ms: {result['estimate']:.2f} °C")
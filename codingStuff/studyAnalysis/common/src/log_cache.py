@@ -0,0 +1,177 @@
+import glob
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from common.src.binary_log import is_binary_log, open_binary_log, records_to_dataframe
+from common.src.motion_artifacts import QUALITY_COLUMN, quality_mask
+from common.src.sd_log_reader import read_sd_log
+
+try:
+    import pyarrow as pa
+except ImportError:  # without pyarrow every run simply parses the CSV again
+    pa = None
+
+TEMP_COLUMNS = ['TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle']
+CACHE_VERSION = 9
+CACHE_SUFFIX = '.cache.arrow'
+# Schema metadata of a cache, the size and modification time of the log it was written for
+SOURCE_STAMP_KEY = b'source_stamp'
+# .<options key>.<content digest>.cache.arrow, so caches of e.g. foo.csv.bak.csv are not taken for foo.csv's
+CACHE_NAME = re.compile(r'\.[0-9a-f]{8}\.[0-9a-f]{16}' + re.escape(CACHE_SUFFIX))
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """Returns the sha1 hex digest of the file content"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_log_frame(file_path):
+    if is_binary_log(file_path):
+        return records_to_dataframe(open_binary_log(file_path))
+    try:
+        log = read_sd_log(file_path)
+    except ValueError:
+        # Not the SD_Logger layout, e.g. hand edited or converted files
+        return pd.read_csv(file_path)
+    if log.truncated:
+        print(f"Dropped the incomplete last row of {file_path}")
+    return log.to_dataframe()
+
+
+def parse_earable_log(file_path, temp_columns=TEMP_COLUMNS, replace_zeros=True, scale=True, motion_mask=True):
+    df = prepare_log_frame(read_log_frame(file_path), temp_columns, replace_zeros, scale)
+    if motion_mask:
+        # The motion mask needs the whole recording for its windows, it is cached along with the parsed columns
+        df[QUALITY_COLUMN] = quality_mask(df)
+    return df
+
+
+def prepare_log_frame(df, temp_columns=TEMP_COLUMNS, replace_zeros=True, scale=True):
+    if replace_zeros:
+        # The firmware writes 0 for every sensor which was not read in this row
+        df[temp_columns] = df[temp_columns].replace(0, np.nan)
+    if scale:
+        df[temp_columns] = df[temp_columns] / 100.0
+
+    # Store compact, explicit types so the cached file does not depend on pandas' inference. Integer columns which
+    # are already narrower, like the record types of binary logs, stay views of the mapped file. Columns are cast
+    # one by one, DataFrame.astype would copy all others as well
+    for col in df.columns:
+        if col in temp_columns and (replace_zeros or scale):
+            dtype = np.dtype('float64')
+        elif pd.api.types.is_integer_dtype(df[col]):
+            dtype = np.dtype('int64' if col == 'TIMESTAMP' else 'int32')
+            if df[col].dtype.itemsize <= dtype.itemsize:
+                continue
+        else:
+            continue
+        if df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def cache_options_key(temp_columns, replace_zeros, scale, motion_mask):
+    options = f"v{CACHE_VERSION}|{','.join(temp_columns)}|{int(replace_zeros)}|{int(scale)}|{int(motion_mask)}"
+    return hashlib.sha1(options.encode()).hexdigest()[:8]
+
+
+def cache_path_for(file_path, options_key, digest):
+    # One cache per set of options, named by the content hash so edited CSVs are parsed again
+    return f"{file_path}.{options_key}.{digest[:16]}{CACHE_SUFFIX}"
+
+
+def source_stamp(file_path):
+    """Size and modification time of the log, a cache stamped with them is taken without hashing the content"""
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}".encode()
+
+
+def cached_paths(file_path, options_key):
+    pattern = f"{glob.escape(file_path)}.{options_key}.*{CACHE_SUFFIX}"
+    return [path for path in glob.glob(pattern) if CACHE_NAME.fullmatch(path[len(file_path):])]
+
+
+def read_cache_table(cache_path, memory_map=True):
+    # Arrow IPC buffers are used in place, with memory_map they point into the mapped file instead of RAM
+    source = pa.memory_map(cache_path, 'r') if memory_map else pa.OSFile(cache_path, 'rb')
+    with source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def table_to_frame(table):
+    # split_blocks keeps one block per column, so numeric columns without nulls are views of the mapped buffers
+    # instead of being copied into consolidated blocks. Such columns are read-only, they are replaced, not written.
+    return table.to_pandas(split_blocks=True)
+
+
+def frame_to_table(df, stamp):
+    # from_pandas=False keeps NaN as a float value instead of a null, nulls would force a copy on every read
+    columns = {col: pa.array(df[col].to_numpy(), from_pandas=not pd.api.types.is_numeric_dtype(df[col]))
+               for col in df.columns}
+    return pa.table(columns, metadata={SOURCE_STAMP_KEY: stamp})
+
+
+def write_cache(table, cache_path):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    # Atomic rename, so a concurrently running pipeline never sees a half written cache
+    os.replace(tmp_path, cache_path)
+
+    # Remove every other cache of the same CSV: older contents, older CACHE_VERSIONs and other options
+    log_path = cache_path[:-len(CACHE_SUFFIX)].rsplit('.', 2)[0]
+    for stale_path in glob.glob(f"{glob.escape(log_path)}.*{CACHE_SUFFIX}"):
+        if stale_path != cache_path and CACHE_NAME.fullmatch(stale_path[len(log_path):]):
+            os.remove(stale_path)
+
+
+def load_earable_log(file_path, temp_columns=TEMP_COLUMNS, replace_zeros=True, scale=True, use_cache=True,
+                     motion_mask=True):
+    """
+    Loads an earable CSV log, reusing a content-hashed columnar copy next to the CSV if one exists. A cache whose
+    stamp matches the log's size and modification time is memory-mapped without reading the log at all, only a
+    changed stamp costs a content hash. motion_mask adds the per-sample motion quality mask as column
+    QUALITY_COLUMN, so it is computed once per log content.
+    """
+    # Binary logs are mapped directly, a cached copy would not be faster to read
+    if not use_cache or pa is None or is_binary_log(file_path):
+        return parse_earable_log(file_path, temp_columns, replace_zeros, scale, motion_mask)
+
+    options_key = cache_options_key(temp_columns, replace_zeros, scale, motion_mask)
+    stamp = source_stamp(file_path)
+    for cache_path in cached_paths(file_path, options_key):
+        try:
+            table = read_cache_table(cache_path)
+        except (OSError, pa.ArrowInvalid):
+            print(f"Ignoring unreadable cache file: {cache_path}")
+            continue
+        if (table.schema.metadata or {}).get(SOURCE_STAMP_KEY) == stamp:
+            return table_to_frame(table)
+
+    # Touched or copied logs keep their cache if the content is the same, it is stamped again
+    cache_path = cache_path_for(file_path, options_key, file_digest(file_path))
+    table = None
+    if os.path.exists(cache_path):
+        try:
+            # Read into memory, the file is replaced below and must not stay mapped
+            table = read_cache_table(cache_path, memory_map=False)
+        except (OSError, pa.ArrowInvalid):
+            print(f"Ignoring unreadable cache file: {cache_path}")
+    if table is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_STAMP_KEY: stamp})
+    else:
+        table = frame_to_table(parse_earable_log(file_path, temp_columns, replace_zeros, scale, motion_mask), stamp)
+    try:
+        write_cache(table, cache_path)
+    except OSError as error:
+        print(f"Could not write cache file {cache_path}: {error}")
+    return table_to_frame(table)
@@ -0,0 +1,64 @@
+import numpy as np
+
+from common.src.smoothing import rolling_mean, window_starts
+
+# Column of the per-sample quality mask in parsed and cached log frames
+QUALITY_COLUMN = 'MOTION_OK'
+ACC_COLUMNS = ['ACC_X', 'ACC_Y', 'ACC_Z']
+GYRO_COLUMNS = ['GYRO_X', 'GYRO_Y', 'GYRO_Z']
+
+
+def robust_scores(values):
+    """Distance from the median in units of the scaled median absolute deviation, NaN stays NaN"""
+    median = np.nanmedian(values)
+    mad = 1.4826 * np.nanmedian(np.abs(values - median))
+    return (values - median) / max(mad, np.finfo(np.float64).eps * max(abs(median), 1.0))
+
+
+def motion_quality(timestamps, acc, gyro, window='2s', threshold=6.0, hold='10s', seconds_per_unit=0.001):
+    """
+    Per-sample quality mask, False during and shortly after head movement. Movement is the mean change of the
+    acceleration magnitude between samples and the mean rotation rate within a trailing time window. A window
+    is an artifact when one of them is more than threshold robust standard deviations above the recording's
+    median, which adapts to the IMU's units and offsets. The ear sensors take a while to settle again after the
+    earable moved, so every sample within hold after an artifact is rejected as well. All windows are cumulative
+    sums, the cost is linear in samples whatever the window sizes.
+    """
+    timestamps = np.maximum.accumulate(np.asarray(timestamps, dtype=np.float64))
+    acc_magnitude = np.sqrt((np.asarray(acc, dtype=np.float64) ** 2).sum(axis=1))
+    gyro_magnitude = np.sqrt((np.asarray(gyro, dtype=np.float64) ** 2).sum(axis=1))
+    if len(timestamps) == 0:
+        return np.ones(0, dtype=bool)
+
+    jerk = np.abs(np.diff(acc_magnitude, prepend=acc_magnitude[0]))
+    activity = rolling_mean(np.column_stack((jerk, gyro_magnitude)), window, timestamps=timestamps,
+                            seconds_per_unit=seconds_per_unit).astype(np.float64)
+    with np.errstate(invalid='ignore'):
+        artifact = (robust_scores(activity[:, 0]) > threshold) | (robust_scores(activity[:, 1]) > threshold)
+
+    # A sample is rejected if any artifact lies in (t - hold, t]
+    artifact_counts = np.concatenate(([0], np.cumsum(artifact)))
+    starts = window_starts(len(timestamps), hold, timestamps, seconds_per_unit)
+    return artifact_counts[1:] - artifact_counts[starts] == 0
+
+
+def quality_mask(df, window='2s', threshold=6.0, hold='10s', seconds_per_unit=0.001):
+    """motion_quality of a log frame, all True for logs without IMU columns"""
+    if not set(ACC_COLUMNS + GYRO_COLUMNS) <= set(df.columns):
+        return np.ones(len(df), dtype=bool)
+    return motion_quality(df['TIMESTAMP'].to_numpy(), df[ACC_COLUMNS].to_numpy(), df[GYRO_COLUMNS].to_numpy(),
+                          window, threshold, hold, seconds_per_unit)
+
+
+def apply_quality_mask(df, temp_columns, mask=None):
+    """
+    Sets the temperatures of rejected samples to NaN, which every analysis already skips. Without a mask the one
+    parsed with the log is used, or it is computed from the frame, whose TIMESTAMP must then still be the logger's
+    milliseconds.
+    """
+    if mask is None:
+        mask = df[QUALITY_COLUMN].to_numpy() if QUALITY_COLUMN in df.columns else quality_mask(df)
+    # The columns are replaced instead of written in place, cached frames hold read-only views of the cache file
+    keep = np.asarray(mask, dtype=bool)[:, None]
+    df[temp_columns] = np.where(keep, df[temp_columns].to_numpy(dtype=np.float64), np.nan)
+    return df
@@ -0,0 +1,36 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+def map_ordered(function, jobs, num_workers=1, skip_errors=True):
+    """
+    Calls function(*job) for every job, in a pool of num_workers processes if num_workers > 1, and returns the
+    results in the order of jobs. A job which raises is reported and left out, so one broken recording does not
+    stop the whole cohort. With skip_errors=False the error of the first failed job is raised instead, for callers
+    whose results must line up with their jobs.
+    """
+    jobs = list(jobs)
+    outcomes = []
+    if num_workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(jobs))) as executor:
+            futures = [executor.submit(function, *job) for job in jobs]
+            for future in futures:
+                try:
+                    outcomes.append((future.result(), None))
+                except Exception as error:
+                    outcomes.append((None, error))
+    else:
+        for job in jobs:
+            try:
+                outcomes.append((function(*job), None))
+            except Exception as error:
+                outcomes.append((None, error))
+
+    results = []
+    for job, (result, error) in zip(jobs, outcomes):
+        if error is not None and not skip_errors:
+            raise error
+        if error is None:
+            results.append(result)
+        else:
+            print(f"Skipping {job[0]}: {type(error).__name__}: {error}")
+    return results
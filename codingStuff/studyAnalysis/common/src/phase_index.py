@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class PhaseIndex:
+    """
+    Row ranges of every phase ID, built with one pass over the ID column. The firmware only ever counts the ID
+    up, so a phase is normally one contiguous run of rows and selecting it is a slice instead of a scan.
+    """
+
+    def __init__(self, ids):
+        ids = np.asarray(ids)
+        self.n_rows = len(ids)
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1]))) if len(ids) else np.empty(0, int)
+        ends = np.append(starts[1:], len(ids))
+
+        self.runs = {}  # phase -> [(start, end), ...] in row order
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            self.runs.setdefault(ids[start].item(), []).append((start, end))
+
+    @property
+    def phases(self):
+        """Phase IDs in order of their first row, like unique()"""
+        return list(self.runs)
+
+    def __contains__(self, phase):
+        return phase in self.runs
+
+    def get_runs(self, phases):
+        if np.isscalar(phases):
+            phases = [phases]
+        runs = sorted(run for phase in phases for run in self.runs.get(phase, []))
+
+        # Neighbouring phases, e.g. 2, 3 and 4, become one run
+        merged = []
+        for start, end in runs:
+            if merged and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    def rows(self, phases):
+        """A slice if the phases cover one contiguous range of rows, otherwise an array of row positions"""
+        runs = self.get_runs(phases)
+        if not runs:
+            return slice(0, 0)
+        if len(runs) == 1:
+            return slice(*runs[0])
+        return np.concatenate([np.arange(start, end) for start, end in runs])
+
+    def bounds(self, phase):
+        """First row and end row of a phase"""
+        runs = self.runs[phase]
+        return runs[0][0], runs[-1][1]
+
+    def take(self, values, phases):
+        """Rows of values (array over all rows) in the given phases, a view whenever the phases are contiguous"""
+        return values[self.rows(phases)]
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+STATISTICS = ['count', 'mean', 'var', 'std', 'mad', 'gt_error']
+
+
+class PhaseStatistics:
+    """
+    Mean, variance, standard deviation, mean absolute deviation and ground truth error of every participant, phase
+    and sensor. All (participant, phase) segments are packed into one array and reduced with np.add.reduceat, so
+    the cost does not depend on the number of cells. NaN is skipped like pandas does, variances use ddof=0 like
+    np.var, and a cell without any valid value is NaN.
+    """
+
+    def __init__(self, all_temp_data, phases, temp_columns=None):
+        self.phases = list(phases)
+        self.temp_columns = list(temp_columns or all_temp_data[0].temp_columns)
+        self.source_filenames = [temp_data.source_filename for temp_data in all_temp_data]
+        n_participants, n_phases, n_sensors = len(all_temp_data), len(self.phases), len(self.temp_columns)
+
+        segments = []
+        ground_truths = []
+        for temp_data in all_temp_data:
+            for phase in self.phases:
+                segments.append(temp_data.get_phase_data(phase)[self.temp_columns].to_numpy(dtype=np.float64))
+            ground_truths.append(temp_data.real_temp_ground_truth)
+
+        lengths = np.array([len(segment) for segment in segments], dtype=np.int64)
+        values = np.concatenate(segments) if segments else np.empty((0, n_sensors))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        segment_of_row = np.repeat(np.arange(len(segments)), lengths)
+
+        valid = ~np.isnan(values)
+        counts = self.segment_sums(valid.astype(np.float64), starts, lengths)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.segment_sums(np.where(valid, values, 0), starts, lengths) / counts
+            deviations = np.where(valid, values - means[segment_of_row], 0)
+            variances = self.segment_sums(deviations ** 2, starts, lengths) / counts
+            mads = self.segment_sums(np.abs(deviations), starts, lengths) / counts
+
+        shape = (n_participants, n_phases, n_sensors)
+        self.n_rows = lengths.reshape(n_participants, n_phases)
+        self.arrays = {
+            'count': counts.reshape(shape),
+            'mean': means.reshape(shape),
+            'var': variances.reshape(shape),
+            'std': np.sqrt(variances).reshape(shape),
+            'mad': mads.reshape(shape),
+        }
+        self.arrays['gt_error'] = self.arrays['mean'] - np.asarray(ground_truths, dtype=np.float64)[:, None, None]
+
+    @classmethod
+    def reuse(cls, statistics, all_temp_data, phases):
+        """statistics if it was computed for all of the phases, PhaseStatistics of the phases otherwise"""
+        if statistics is not None and set(phases) <= set(statistics.phases):
+            return statistics
+        return cls(all_temp_data, phases)
+
+    @staticmethod
+    def segment_sums(values, starts, lengths):
+        sums = np.zeros((len(starts), values.shape[1]))
+        # reduceat cannot express empty segments, they would get the value of the next row
+        non_empty = lengths > 0
+        if non_empty.any():
+            sums[non_empty] = np.add.reduceat(values, starts[non_empty], axis=0)
+        return sums
+
+    def get(self, statistic, phase):
+        """(participant x sensor) array of one statistic in one phase"""
+        return self.arrays[statistic][:, self.phases.index(phase)]
+
+    def present(self, phase):
+        """Participants with at least one row in the phase"""
+        return self.n_rows[:, self.phases.index(phase)] > 0
+
+    def to_dataframe(self):
+        n_participants, n_phases, n_sensors = self.arrays['mean'].shape
+        index = pd.MultiIndex.from_product([range(n_participants), self.phases, self.temp_columns],
+                                           names=['Participant', 'Phase', 'Sensor'])
+        table = pd.DataFrame({statistic: self.arrays[statistic].ravel() for statistic in STATISTICS}, index=index)
+        table['count'] = table['count'].astype('int64')
+        table.insert(0, 'n_rows', np.repeat(self.n_rows.ravel(), n_sensors))
+        table.insert(0, 'Source', np.repeat(self.source_filenames, n_phases * n_sensors))
+        return table.reset_index()
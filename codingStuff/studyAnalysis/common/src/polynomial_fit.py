@@ -0,0 +1,90 @@
+import numpy as np
+from numpy.polynomial import chebyshev
+
+
+def shared_mask(x, y):
+    """Rows where every sensor and the target are valid, so all sensors are fitted on the same samples"""
+    return np.isfinite(x).all(axis=1) & np.isfinite(y)
+
+
+class PolynomialFit:
+    """
+    Least-squares polynomials from every column of x (n_samples x n_sensors) to the target y, up to max_degree.
+    Each sensor is scaled to [-1, 1] over its own range and expanded in Chebyshev polynomials, which keeps
+    degree 32 well conditioned. The design matrices of all sensors are QR-decomposed in one batched call. As the
+    Chebyshev columns are ordered by degree, the leading block of that QR is the QR of every lower degree, so each
+    further degree is only a small triangular solve. Fits are cached per degree.
+    """
+
+    def __init__(self, x, y, max_degree, mask=None):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x.ndim == 1:
+            x = x[:, None]
+        mask = shared_mask(x, y) if mask is None else mask
+        x, y = x[mask], y[mask]
+
+        self.max_degree = max_degree
+        self.n_samples = len(y)
+        self.domains = np.column_stack((x.min(axis=0), x.max(axis=0))) if len(y) else np.zeros((x.shape[1], 2))
+        self.domains[self.domains[:, 1] == self.domains[:, 0], 1] += 1.0  # constant sensors would divide by zero
+
+        # sensors x samples x terms, with y appended as last column the R factor also holds Q^T y, so Q is never formed
+        design = chebyshev.chebvander(self.scale(x), max_degree).transpose(1, 0, 2)
+        augmented = np.concatenate((design, np.broadcast_to(y[None, :, None], (len(design), len(y), 1))), axis=2)
+        r = np.linalg.qr(augmented, mode='r')
+        self.r = r[:, :max_degree + 1, :max_degree + 1]
+        self.projections = r[:, :max_degree + 1, -1]
+        self.fits = {}
+
+    def scale(self, x):
+        low, high = self.domains[:, 0], self.domains[:, 1]
+        return (2.0 * x - (low + high)) / (high - low)
+
+    def coefficients(self, degree):
+        """(n_sensors x degree + 1) Chebyshev coefficients on the scaled axis, lowest order first"""
+        if degree > self.max_degree:
+            raise ValueError(f"Degree {degree} is above the fitted maximum of {self.max_degree}")
+        if degree not in self.fits:
+            terms = degree + 1
+            self.fits[degree] = np.linalg.solve(self.r[:, :terms, :terms], self.projections[:, :terms, None])[..., 0]
+        return self.fits[degree]
+
+    def evaluate(self, x, degree):
+        """Calibrated values of x (n_samples x n_sensors), NaN stays NaN"""
+        x = np.asarray(x, dtype=np.float64)
+        scaled = self.scale(x if x.ndim == 2 else x[:, None])
+        coefficients = self.coefficients(degree)
+        return np.column_stack([chebyshev.chebval(scaled[:, sensor], coefficients[sensor])
+                                for sensor in range(len(coefficients))])
+
+    def power_coefficients(self, degree):
+        """
+        Legacy: coefficients on the raw axis in np.polyfit order (highest power first) for every sensor, only for
+        readers of the old JSON format. Powers of raw °C are ill-conditioned, at high degrees they are rounded so far
+        that they no longer reproduce the fit (see power_form_error). The Chebyshev form of coefficients and
+        chebyshev_parameters is the authoritative result. They are fitted to the cached polynomial at Chebyshev
+        nodes of each sensor's range, so they cost nothing next to the data.
+        """
+        nodes = chebyshev.chebpts1(max(4 * (degree + 1), 64))
+        result = []
+        for coefficients, (low, high) in zip(self.coefficients(degree), self.domains):
+            raw_nodes = (nodes * (high - low) + (low + high)) / 2.0
+            # full=True returns the diagnostics instead of emitting a RankWarning for the high degrees
+            result.append(np.polyfit(raw_nodes, chebyshev.chebval(nodes, coefficients), degree, full=True)[0])
+        return result
+
+    def power_form_error(self, degree, n_points=1001):
+        """Largest deviation (°C) of the legacy power coefficients from the fit over each sensor's range"""
+        grid = np.linspace(-1.0, 1.0, n_points)
+        errors = []
+        for power, coefficients, (low, high) in zip(self.power_coefficients(degree), self.coefficients(degree),
+                                                    self.domains):
+            raw_grid = (grid * (high - low) + (low + high)) / 2.0
+            errors.append(float(np.max(np.abs(np.polyval(power, raw_grid) - chebyshev.chebval(grid, coefficients)))))
+        return errors
+
+    def chebyshev_parameters(self, degree):
+        """Domain and Chebyshev coefficients of every sensor, JSON serializable"""
+        return [{'domain': domain.tolist(), 'coefficients': coefficients.tolist()}
+                for domain, coefficients in zip(self.domains, self.coefficients(degree))]
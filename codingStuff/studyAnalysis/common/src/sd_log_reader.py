@@ -0,0 +1,191 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Layout written by SD_Logger::write_header in oEDataTracker
+SD_LOG_COLUMNS = ['ID', 'TIMESTAMP',
+                  'TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle',
+                  'ObjTympanicMembrane', 'ObjConcha', 'ObjEarCanal', 'ObjOut_Bottom', 'ObjOut_Top', 'ObjOut_Middle',
+                  'ACC_X', 'ACC_Y', 'ACC_Z', 'GYRO_X', 'GYRO_Y', 'GYRO_Z', 'MAG_X', 'MAG_Y', 'MAG_Z']
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+_LF, _CR, _COMMA = 10, 13, 44
+_LINE_ENDS_TO_COMMAS = bytes.maketrans(b'\r\n', b',,')
+_SEPARATORS_TO_BLANKS = bytes.maketrans(b'\r\n,', b'   ')
+_ALLOWED = np.frombuffer(b'0123456789-\r\n, ', dtype=np.uint8)
+
+
+class SDLog:
+    def __init__(self, data, columns, truncated, terminator_timestamp):
+        self.data = data  # (n_rows x n_columns) int32
+        self.columns = columns
+        self.truncated = truncated  # a half written last row was dropped
+        self.terminator_timestamp = terminator_timestamp  # TIMESTAMP of the ID=-1 row, None if there was none
+
+    @property
+    def terminated(self):
+        return self.terminator_timestamp is not None
+
+    def to_dataframe(self):
+        df = pd.DataFrame(self.data, columns=self.columns, copy=False)
+        if 'TIMESTAMP' in df.columns:
+            # millis() is unsigned, int64 keeps it safe to subtract
+            df['TIMESTAMP'] = df['TIMESTAMP'].astype('int64')
+        return df
+
+
+def parse_rows(chunk, n_columns, first_line=1):
+    """Parses complete, CR or LF terminated lines of comma separated integers into an (n_rows x n_columns) array"""
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    line_ends = np.flatnonzero((buf == _CR) | (buf == _LF))
+    commas = np.flatnonzero(buf == _COMMA)
+
+    # "\r\n" line ends and blank lines are empty lines, they are skipped
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    not_empty = line_ends > line_starts
+    commas_per_line = np.diff(np.searchsorted(commas, line_ends), prepend=0)[not_empty]
+    if (commas_per_line != n_columns - 1).any():
+        bad_row = int(np.argmax(commas_per_line != n_columns - 1))
+        raise ValueError(f"Line {first_line + bad_row} has {commas_per_line[bad_row] + 1} columns, "
+                         f"expected {n_columns}")
+    n_rows = len(commas_per_line)
+
+    # With all line ends turned into separators numpy's C parser reads the whole chunk in one call,
+    # a plain comma separated stream without blanks is its fastest input
+    if not_empty.all():
+        text, sep = chunk.translate(_LINE_ENDS_TO_COMMAS, b' '), ','
+    else:
+        text, sep = chunk.translate(_SEPARATORS_TO_BLANKS), ' '
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(text, dtype=np.int32, sep=sep)
+    except ValueError:
+        # Newer numpy versions raise instead of returning the values parsed up to the bad character
+        values = np.empty(0, dtype=np.int32)
+    if len(values) != n_rows * n_columns:
+        unexpected = ~np.isin(buf, _ALLOWED)
+        if unexpected.any():
+            position = int(np.argmax(unexpected))
+            line = first_line + int(np.searchsorted(line_ends, position))
+            raise ValueError(f"Unexpected character {chr(buf[position])!r} in line {line}")
+        raise ValueError(f"Expected {n_rows * n_columns} values in lines {first_line} to {first_line + n_rows}, "
+                         f"found {len(values)}")
+
+    return values.reshape(n_rows, n_columns)
+
+
+def find_terminator(chunk):
+    """Returns the position of the first line with ID -1, or -1 if there is none"""
+    if chunk.startswith(b'-1,'):
+        return 0
+    positions = [i + 1 for i in (chunk.find(b'\r-1,'), chunk.find(b'\n-1,')) if i >= 0]
+    return min(positions, default=-1)
+
+
+def parse_terminator(line):
+    fields = line.splitlines()[0].split(b',')
+    try:
+        return int(fields[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def read_header(file):
+    header = b''
+    while True:
+        block = file.read(4096)
+        if not block:
+            raise ValueError("No header line found")
+        header += block
+        end = min((i for i in (header.find(b'\r'), header.find(b'\n')) if i >= 0), default=-1)
+        if end >= 0:
+            columns = [col.strip() for col in header[:end].decode('ascii').split(',')]
+            return columns, header[end:].lstrip(b'\r\n')
+
+
+class SDLogReader:
+    """
+    Iterates a log written by SD_Logger in blocks of parsed rows, at most about chunk_size bytes of text at a time.
+    Lines end with a bare CR. A last line without line end is kept if it is a complete row, one which was cut off by
+    a reset (wrong number of fields or not parsable) is dropped and truncated is set.
+    Reading stops at a row with ID -1. truncated and terminator_timestamp are known once the iteration finished.
+    """
+
+    def __init__(self, file_path, n_columns=len(SD_LOG_COLUMNS), chunk_size=DEFAULT_CHUNK_SIZE):
+        self.file_path = file_path
+        self.n_columns = n_columns
+        self.chunk_size = chunk_size
+        self.columns = None
+        self.truncated = False
+        self.terminator_timestamp = None
+
+    def __iter__(self):
+        n_columns = self.n_columns
+        with open(self.file_path, 'rb') as file:
+            columns, pending = read_header(file)
+            if len(columns) != n_columns:
+                raise ValueError(f"{self.file_path} has {len(columns)} columns, expected {n_columns}")
+            self.columns = columns
+
+            line = 2
+            terminator_timestamp = None
+            while True:
+                block = file.read(self.chunk_size)
+                chunk = pending + block
+                last_term = max(chunk.rfind(b'\r'), chunk.rfind(b'\n'))
+                if last_term < 0:
+                    pending = chunk
+                    if block:
+                        continue
+                    break
+                pending = chunk[last_term + 1:]
+                chunk = chunk[:last_term + 1]
+
+                # The stop marker written on a button press or a sensor failure ends the recording,
+                # it only needs to be searched for if it does not have the full row layout
+                try:
+                    rows = parse_rows(chunk, n_columns, line)
+                    stop_rows = np.flatnonzero(rows[:, 0] == -1)
+                    if len(stop_rows):
+                        terminator_timestamp = int(rows[stop_rows[0], 1])
+                        rows = rows[:stop_rows[0]]
+                except ValueError:
+                    stop = find_terminator(chunk)
+                    if stop < 0:
+                        raise
+                    terminator_timestamp = parse_terminator(chunk[stop:])
+                    rows = parse_rows(chunk[:stop], n_columns, line) if stop else np.empty((0, n_columns), np.int32)
+                line += len(rows)
+
+                if len(rows):
+                    yield rows
+                if terminator_timestamp is not None:
+                    pending = b''
+                    break
+
+        # SD cards can leave the rest of the last cluster filled with zero bytes
+        pending = pending.strip(b'\x00 \t\r\n')
+        if terminator_timestamp is None and pending.startswith(b'-1,'):
+            terminator_timestamp = parse_terminator(pending)
+            pending = b''
+        if pending:
+            try:
+                rows = parse_rows(pending + b'\r', n_columns, line)
+            except ValueError:
+                rows = None
+            if rows is not None and len(rows) == 1:
+                pending = b''
+                yield rows
+        self.truncated = len(pending) > 0
+        self.terminator_timestamp = terminator_timestamp
+
+
+def read_sd_log(file_path, n_columns=len(SD_LOG_COLUMNS), chunk_size=DEFAULT_CHUNK_SIZE):
+    reader = SDLogReader(file_path, n_columns, chunk_size)
+    blocks = list(reader)
+    data = np.concatenate(blocks) if blocks else np.empty((0, n_columns), dtype=np.int32)
+    return SDLog(data, reader.columns, reader.truncated, reader.terminator_timestamp)
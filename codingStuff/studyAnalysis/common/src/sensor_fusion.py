@@ -0,0 +1,294 @@
+import numpy as np
+import pandas as pd
+
+from common.src.state_space import rts_smoother
+
+IMU_FEATURES = ['ACC_Magnitude', 'GYRO_Magnitude']
+# The ridge penalty acts on standardized features with participant weights summing to one, so the gram matrix is
+# about a correlation matrix and alpha = 1 already shrinks as much as the data. It is chosen by inner CV from these.
+RIDGE_ALPHAS = (1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+
+
+def ground_truth_of(temp_data):
+    # Study 1 calls it real_temp_ground_truth, study 2 ground_truth_temp
+    return getattr(temp_data, 'real_temp_ground_truth', getattr(temp_data, 'ground_truth_temp', np.nan))
+
+
+def imu_features(raw_data, timestamps):
+    """Accelerometer and gyroscope magnitude of the raw row nearest to (at or after) each timestamp"""
+    if not {'ACC_X', 'GYRO_X'} <= set(raw_data.columns):
+        return np.full((len(timestamps), len(IMU_FEATURES)), np.nan)  # log without IMU columns
+    rows = np.minimum(np.searchsorted(raw_data['TIMESTAMP'].to_numpy(), timestamps), len(raw_data) - 1)
+    acc = raw_data[['ACC_X', 'ACC_Y', 'ACC_Z']].to_numpy(dtype=np.float64)[rows]
+    gyro = raw_data[['GYRO_X', 'GYRO_Y', 'GYRO_Z']].to_numpy(dtype=np.float64)[rows]
+    return np.column_stack((np.sqrt((acc ** 2).sum(axis=1)), np.sqrt((gyro ** 2).sum(axis=1))))
+
+
+class FusionData:
+    """
+    The dense sensor arrays of all participants packed into one (cycles x sensors) array, with the participant of
+    every cycle and its ground truth, so fitting and inference are single matrix operations over the cohort.
+    values keeps NaN for sensors not read in a cycle, filled holds the last reading of each sensor instead and
+    complete marks the cycles where filled has every sensor.
+    """
+
+    def __init__(self, values, ground_truth, groups, columns, timestamps=None, features=None, sources=None):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.ground_truth = np.asarray(ground_truth, dtype=np.float64)
+        self.groups = np.asarray(groups, dtype=np.int64)
+        self.columns = list(columns)
+        self.timestamps = timestamps
+        self.features = features  # (cycles x len(IMU_FEATURES)) or None
+        self.sources = sources
+        self.moments = {}  # ParticipantMoments of the RidgeFusion designs, shared by its folds
+        self.n_groups = int(self.groups.max()) + 1 if len(self.groups) else 0
+
+        filled = pd.DataFrame(self.values).groupby(self.groups).ffill().to_numpy()
+        self.filled = filled
+        self.complete = np.isfinite(filled).all(axis=1)
+
+    @classmethod
+    def from_temp_data(cls, all_temp_data, phases=None, with_imu=False):
+        values, ground_truth, groups, timestamps, features, sources = [], [], [], [], [], []
+        for group, temp_data in enumerate(all_temp_data):
+            dense = temp_data.get_dense_data()
+            if phases is not None:
+                dense = dense.select(np.isin(dense.cycle_ids, np.atleast_1d(phases)))
+            values.append(dense.values.astype(np.float64))
+            ground_truth.append(np.full(len(dense), ground_truth_of(temp_data)))
+            groups.append(np.full(len(dense), group))
+            timestamps.append(dense.cycle_timestamps)
+            if with_imu:
+                features.append(imu_features(temp_data.raw_data, dense.cycle_timestamps))
+            sources.append(temp_data.source_filename)
+        columns = all_temp_data[0].temp_columns
+        return cls(np.concatenate(values), np.concatenate(ground_truth), np.concatenate(groups), columns,
+                   np.concatenate(timestamps), np.concatenate(features) if with_imu else None, sources)
+
+    def select(self, rows):
+        """FusionData of some rows, whole participants keep their filled values"""
+        return FusionData(self.values[rows], self.ground_truth[rows], self.groups[rows], self.columns,
+                          None if self.timestamps is None else self.timestamps[rows],
+                          None if self.features is None else self.features[rows], self.sources)
+
+    def sample_weights(self, rows):
+        # Every participant counts the same, however long the recording
+        counts = np.bincount(self.groups[rows], minlength=self.n_groups)
+        return 1.0 / counts[self.groups[rows]] / np.count_nonzero(counts)
+
+    def participant_means(self, estimates):
+        """(participants x ...) mean of per-cycle estimates, NaN ignored"""
+        estimates = np.asarray(estimates, dtype=np.float64)
+        flat = estimates.reshape(len(estimates), -1)
+        valid = np.isfinite(flat)
+        sums = np.zeros((self.n_groups, flat.shape[1]))
+        counts = np.zeros((self.n_groups, flat.shape[1]))
+        np.add.at(sums, self.groups, np.where(valid, flat, 0.0))
+        np.add.at(counts, self.groups, valid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (sums / counts).reshape((self.n_groups,) + estimates.shape[1:])
+
+    def participant_ground_truth(self):
+        return self.participant_means(self.ground_truth)
+
+
+class WeightedLeastSquaresFusion:
+    """
+    Best linear unbiased combination of biased sensors: each sensor's bias against the ground truth is removed
+    and the sensors are weighted with the inverse covariance of their errors, w = S^-1 1 / 1' S^-1 1. With
+    diagonal=True the error covariance is reduced to the variances (inverse-variance weighting).
+    """
+
+    def __init__(self, diagonal=False):
+        self.diagonal = diagonal
+        self.biases = None
+        self.covariance = None
+        self.weights = None
+
+    def fit(self, data, rows=None):
+        rows = data.complete if rows is None else rows & data.complete
+        errors = data.filled[rows] - data.ground_truth[rows, None]
+        sample_weights = data.sample_weights(rows)
+        self.biases = sample_weights @ errors
+        centered = errors - self.biases
+        self.covariance = (centered * sample_weights[:, None]).T @ centered
+        self.weights = self.subset_weights([np.ones(len(data.columns), dtype=bool)])[:, 0]
+        return self
+
+    def subset_weights(self, subsets):
+        """(sensors x subsets) weight matrix for boolean sensor masks, sensors outside a subset get weight 0"""
+        subsets = np.atleast_2d(np.asarray(subsets, dtype=bool))
+        weights = np.zeros((subsets.shape[1], len(subsets)))
+        covariance = np.diag(np.diag(self.covariance)) if self.diagonal else self.covariance
+        for i, subset in enumerate(subsets):
+            inverse_ones = np.linalg.solve(covariance[np.ix_(subset, subset)], np.ones(subset.sum()))
+            weights[subset, i] = inverse_ones / inverse_ones.sum()
+        return weights
+
+    def predict(self, data, subsets=None):
+        """Fused estimate of every cycle, (cycles x subsets) for many sensor subsets in one matrix product"""
+        weights = self.weights[:, None] if subsets is None else self.subset_weights(subsets)
+        estimates = (data.filled - self.biases) @ weights
+        return estimates[:, 0] if subsets is None else estimates
+
+
+class ParticipantMoments:
+    """
+    Means of x, y, xx', xy and y² over the rows of every participant, with x and y shifted by their overall means to
+    keep the products well conditioned. Participants count the same, so the normal equations of any set of them are
+    plain averages of these and a fold of the leave-one-participant-out needs no pass over the rows.
+    """
+
+    def __init__(self, x, y, groups, n_groups):
+        self.x_shift = x.mean(axis=0) if len(x) else np.zeros(x.shape[1])
+        self.y_shift = y.mean() if len(y) else 0.0
+        x = x - self.x_shift
+        y = y - self.y_shift
+        self.counts = np.bincount(groups, minlength=n_groups)
+        n_features = x.shape[1]
+        self.x = np.zeros((n_groups, n_features))
+        self.y = np.zeros(n_groups)
+        self.xx = np.zeros((n_groups, n_features, n_features))
+        self.xy = np.zeros((n_groups, n_features))
+        self.yy = np.zeros(n_groups)
+        for group in np.flatnonzero(self.counts):
+            rows = groups == group
+            group_x, group_y, count = x[rows], y[rows], self.counts[group]
+            self.x[group] = group_x.mean(axis=0)
+            self.y[group] = group_y.mean()
+            self.xx[group] = group_x.T @ group_x / count
+            self.xy[group] = group_y @ group_x / count
+            self.yy[group] = group_y @ group_y / count
+
+    def ridge(self, included, alphas):
+        """
+        mean, scale, intercept and (alphas x features) coefficients of the ridge fit on the standardized features
+        of the included participants. All alphas come from one eigendecomposition of the gram matrix.
+        """
+        included = included & (self.counts > 0)
+        mean = self.x[included].mean(axis=0)
+        intercept = self.y[included].mean()
+        covariance = self.xx[included].mean(axis=0) - np.outer(mean, mean)
+        cross = self.xy[included].mean(axis=0) - mean * intercept
+        scale = np.sqrt(np.maximum(np.diag(covariance), 0))
+        scale[scale == 0] = 1.0
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance / np.outer(scale, scale))
+        coefficients = (eigenvectors.T @ (cross / scale) / (eigenvalues + alphas[:, None])) @ eigenvectors.T
+        return mean + self.x_shift, scale, intercept + self.y_shift, coefficients
+
+    def squared_errors(self, group, mean, scale, intercept, coefficients):
+        """Mean squared error over the rows of one participant for every row of coefficients"""
+        slopes = coefficients / scale
+        offsets = intercept - self.y_shift - slopes @ (mean - self.x_shift)
+        return (offsets ** 2 + np.einsum('ai,ij,aj->a', slopes, self.xx[group], slopes) + self.yy[group]
+                + 2 * offsets * (slopes @ self.x[group]) - 2 * offsets * self.y[group]
+                - 2 * slopes @ self.xy[group])
+
+
+class RidgeFusion:
+    """
+    Ridge regression of the ground truth on the sensors and optionally the IMU magnitudes. Features are
+    standardized, so alpha acts the same on every feature. Participants count the same, like in the WLS fit.
+    Without a fixed alpha it is chosen from alphas by leave-one-participant-out on the fitted rows, every fold is
+    solved from the ParticipantMoments instead of the rows.
+    """
+
+    def __init__(self, alpha=None, with_imu=False, alphas=RIDGE_ALPHAS):
+        self.fixed_alpha = alpha
+        self.alphas = alphas
+        self.with_imu = with_imu
+        self.alpha = None
+        self.mean = None
+        self.scale = None
+        self.coefficients = None
+        self.intercept = None
+
+    def design(self, data):
+        if self.with_imu:
+            if data.features is None:
+                raise ValueError("RidgeFusion(with_imu=True) needs FusionData.from_temp_data(..., with_imu=True)")
+            return np.column_stack((data.filled, data.features))
+        return data.filled
+
+    def moments(self, data, x, rows):
+        # The moments of whole participants are shared by all folds over the same data
+        finite = np.isfinite(x).all(axis=1)
+        counts = np.bincount(data.groups[rows], minlength=data.n_groups)
+        if not ((counts == 0) | (counts == np.bincount(data.groups[finite], minlength=data.n_groups))).all():
+            return ParticipantMoments(x[rows], data.ground_truth[rows], data.groups[rows], data.n_groups)
+        if self.with_imu not in data.moments:
+            data.moments[self.with_imu] = ParticipantMoments(x[finite], data.ground_truth[finite],
+                                                             data.groups[finite], data.n_groups)
+        return data.moments[self.with_imu]
+
+    def select_alpha(self, moments, included):
+        groups = np.flatnonzero(included)
+        if len(groups) < 2:
+            return 1.0
+        alphas = np.asarray(self.alphas, dtype=np.float64)
+        errors = np.zeros(len(alphas))
+        for group in groups:
+            inner = included.copy()
+            inner[group] = False
+            errors += moments.squared_errors(group, *moments.ridge(inner, alphas))
+        return self.alphas[int(np.argmin(errors))]
+
+    def fit(self, data, rows=None):
+        x = self.design(data)
+        rows = np.isfinite(x).all(axis=1) if rows is None else rows & np.isfinite(x).all(axis=1)
+        moments = self.moments(data, x, rows)
+        included = np.bincount(data.groups[rows], minlength=data.n_groups) > 0
+        self.alpha = self.fixed_alpha if self.fixed_alpha is not None else self.select_alpha(moments, included)
+        self.mean, self.scale, self.intercept, coefficients = moments.ridge(included, np.array([self.alpha]))
+        self.coefficients = coefficients[0]
+        return self
+
+    def predict(self, data):
+        return (self.design(data) - self.mean) / self.scale @ self.coefficients + self.intercept
+
+
+class KalmanFusion:
+    """
+    Kalman (RTS) smoother over time with the sensor biases and error variances of a WLS fit. Readings are used as
+    they arrive, so the round-robin gaps need no filling. process_variance is the drift of the core temperature per
+    read cycle in °C².
+    """
+
+    def __init__(self, process_variance=1e-5):
+        self.process_variance = process_variance
+        self.wls = WeightedLeastSquaresFusion(diagonal=True)
+
+    def fit(self, data, rows=None):
+        self.wls.fit(data, rows)
+        return self
+
+    def predict(self, data, return_variance=False):
+        # All participants are one banded solve, the chain is cut between the cycles of two participants
+        if len(data.values) == 0:
+            return (np.empty(0), np.empty(0)) if return_variance else np.empty(0)
+        process_variances = np.where(data.groups[1:] == data.groups[:-1], self.process_variance, np.inf)
+        means, variances = rts_smoother(data.values, self.wls.biases, np.diag(self.wls.covariance), process_variances)
+        return (means, variances) if return_variance else means
+
+
+def row_means(values):
+    """Mean of every row without NaN, NaN for a row without any value"""
+    valid = np.isfinite(values)
+    counts = valid.sum(axis=1)
+    sums = np.where(valid, values, 0.0).sum(axis=1)
+    return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def leave_one_participant_out(model_factory, data):
+    """Per-cycle estimates where each participant is predicted by a model fitted on all other participants"""
+    estimates = None
+    for group in range(data.n_groups):
+        held_out = data.groups == group
+        if not held_out.any():
+            continue
+        # Only the held-out participant is predicted, a full pass per fold would make this quadratic
+        prediction = model_factory().fit(data, ~held_out).predict(data.select(held_out))
+        if estimates is None:
+            estimates = np.full((len(data.values),) + prediction.shape[1:], np.nan)
+        estimates[held_out] = prediction
+    return estimates
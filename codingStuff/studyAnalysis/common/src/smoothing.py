@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+
+def parse_window(window):
+    """Returns ('samples', n) for an integer window and ('seconds', s) for a time span like '60s' or '2min'"""
+    if isinstance(window, (int, np.integer)):
+        if window < 1:
+            raise ValueError(f"Window must be at least one sample, got {window}")
+        return 'samples', int(window)
+    seconds = pd.Timedelta(window).total_seconds()
+    if seconds <= 0:
+        raise ValueError(f"Window must be a positive time span, got {window!r}")
+    return 'seconds', seconds
+
+
+def window_starts(n_rows, window, timestamps=None, seconds_per_unit=1.0):
+    """First row of the trailing window of every row, time windows cover (t - window, t] like pandas"""
+    kind, size = parse_window(window)
+    if kind == 'samples':
+        return np.maximum(np.arange(n_rows) - size + 1, 0)
+
+    if timestamps is None:
+        raise ValueError("Time based windows need timestamps")
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if np.any(np.diff(timestamps) < 0):
+        raise ValueError("Timestamps must be non-decreasing for time based windows")
+    return np.searchsorted(timestamps, timestamps - size / seconds_per_unit, side='right')
+
+
+def rolling_mean(values, window, min_periods=1, timestamps=None, seconds_per_unit=1.0):
+    """
+    Trailing moving average over the rows of a 2D array which skips NaN like pandas' rolling().mean(). Sums and
+    counts come from cumulative sums, so the cost does not depend on the window. Accumulated in float64 to keep
+    long recordings free of drift, returned as float32.
+    """
+    values = np.asarray(values)
+    if values.ndim == 1:
+        return rolling_mean(values[:, None], window, min_periods, timestamps, seconds_per_unit)[:, 0]
+
+    n_rows = len(values)
+    starts = window_starts(n_rows, window, timestamps, seconds_per_unit)
+    ends = np.arange(1, n_rows + 1)
+
+    valid = ~np.isnan(values)
+    sums = np.zeros((n_rows + 1, values.shape[1]))
+    np.cumsum(np.where(valid, values, 0), axis=0, dtype=np.float64, out=sums[1:])
+    counts = np.zeros((n_rows + 1, values.shape[1]), dtype=np.int64)
+    np.cumsum(valid, axis=0, out=counts[1:])
+
+    window_sums = sums[ends] - sums[starts]
+    window_counts = counts[ends] - counts[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = window_sums / window_counts
+    means[window_counts < max(min_periods, 1)] = np.nan
+    return means.astype(np.float32)
+
+
+def smooth_frame(df, columns, window, min_periods=1, seconds_per_unit=1.0):
+    """Smooths the given columns of df, ID and TIMESTAMP are kept as they are"""
+    timestamps = df['TIMESTAMP'].to_numpy() if 'TIMESTAMP' in df.columns else None
+    means = rolling_mean(df[columns].to_numpy(dtype=np.float64), window, min_periods, timestamps, seconds_per_unit)
+
+    smoothed = pd.DataFrame(means, columns=columns, index=df.index)
+    for col in ('TIMESTAMP', 'ID'):
+        if col in df.columns:
+            smoothed.insert(0, col, df[col])
+    return smoothed
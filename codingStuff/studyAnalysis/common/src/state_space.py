@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+from scipy.linalg import cho_solve_banded, cholesky_banded, solve_banded
+
+
+def observation_information(observations, biases, variances):
+    """
+    Per time step, the summed precision of the sensors that were read and the precision-weighted sum of their
+    bias-corrected readings. NaN marks a sensor that was not read, so round-robin gaps need no special casing.
+    """
+    observations = np.asarray(observations, dtype=np.float64)
+    precisions = 1.0 / np.asarray(variances, dtype=np.float64)
+    observed = np.isfinite(observations)
+    information = np.where(observed, precisions, 0.0).sum(axis=1)
+    weighted = np.where(observed, (observations - biases) * precisions, 0.0).sum(axis=1)
+    return information, weighted
+
+
+def rts_smoother(observations, biases, variances, process_variances, initial_mean=None, initial_variance=1e6):
+    """
+    Forward-backward (Rauch-Tung-Striebel) smoothing of a scalar random walk (core temperature) observed by several
+    biased, noisy sensors, (time x sensor) observations with NaN where a sensor was not read. process_variances is
+    the variance of the change between consecutive steps, one value or one per step (n - 1), an infinite variance
+    decouples two steps so independent recordings can be smoothed in one call. Returns the smoothed means and
+    variances.
+
+    The smoothed means of a Gaussian chain solve a tridiagonal system, the precision matrix of the whole
+    recording, so the forward and backward pass are one banded Cholesky factorization and one banded solve in
+    LAPACK. The smoothed variances are the diagonal of its inverse, which the factor gives in one more bidiagonal
+    solve (Takahashi recursion). All of it is linear in the number of steps and without a Python loop.
+    """
+    information, weighted = observation_information(observations, biases, variances)
+    n = len(information)
+    if n == 0:
+        return np.empty(0), np.empty(0)
+    step_precisions = 1.0 / np.broadcast_to(np.asarray(process_variances, dtype=np.float64), (n - 1,))
+    if initial_mean is None:
+        total = information.sum()
+        initial_mean = weighted.sum() / total if total > 0 else 0.0
+
+    diagonal = information.copy()
+    diagonal[0] += 1.0 / initial_variance
+    diagonal[1:] += step_precisions
+    diagonal[:-1] += step_precisions
+    rhs = weighted.copy()
+    rhs[0] += initial_mean / initial_variance
+
+    precision = np.zeros((2, n))
+    precision[0] = diagonal
+    precision[1, :-1] = -step_precisions
+    factor = cholesky_banded(precision, lower=True, check_finite=False)
+    means = cho_solve_banded((factor, True), rhs, check_finite=False)
+
+    # var_t = 1 / L_tt^2 + (L_t+1,t / L_tt)^2 var_t+1, an upper bidiagonal system
+    recursion = np.ones((2, n))
+    recursion[0, 1:] = -(factor[1, :-1] / factor[0, :-1]) ** 2
+    state_variances = solve_banded((0, 1), recursion, 1.0 / factor[0] ** 2, check_finite=False)
+    return means, state_variances
+
+
+class StateSpaceSmoother:
+    """
+    Core temperature as a random walk with process_variance in °C² per time unit of the timestamps, every sensor
+    an observation of it with its own bias and noise variance. Biases and variances which are not given are
+    estimated by fit with EM: smooth, then set each sensor's bias and variance to the mean and mean square of its
+    residuals against the smoothed state (plus the state variance), and repeat. Without given biases the latent
+    level is only defined up to a constant, estimated biases are therefore centered, so the state follows the mean
+    sensor level. Biases against the ground truth (e.g. WeightedLeastSquaresFusion.biases) make it core temperature.
+    """
+
+    def __init__(self, process_variance=1e-3, biases=None, variances=None, n_iterations=20, min_step=1e-6):
+        self.process_variance = process_variance
+        self.biases = None if biases is None else np.asarray(biases, dtype=np.float64)
+        self.variances = None if variances is None else np.asarray(variances, dtype=np.float64)
+        self.estimate_biases = biases is None
+        self.estimate_variances = variances is None
+        self.n_iterations = n_iterations
+        self.min_step = min_step  # steps without a time difference still get a little process noise
+
+    def step_variances(self, timestamps):
+        return self.process_variance * np.maximum(np.diff(np.asarray(timestamps, dtype=np.float64)), self.min_step)
+
+    def fit(self, observations, timestamps):
+        observations = np.asarray(observations, dtype=np.float64)
+        observed = np.isfinite(observations)
+        if self.estimate_biases:
+            self.biases = np.nanmean(observations, axis=0) - np.nanmean(observations)
+        if self.estimate_variances:
+            self.variances = np.nanvar(observations - self.biases, axis=0)
+        if not (self.estimate_biases or self.estimate_variances):
+            return self
+
+        step_variances = self.step_variances(timestamps)
+        for _ in range(self.n_iterations):
+            means, state_variances = rts_smoother(observations, self.biases, self.variances, step_variances)
+            residuals = observations - means[:, None]
+            counts = observed.sum(axis=0)
+            if self.estimate_biases:
+                self.biases = np.nansum(residuals, axis=0) / counts
+                self.biases -= np.nanmean(self.biases)
+            if self.estimate_variances:
+                squares = np.where(observed, (residuals - self.biases) ** 2 + state_variances[:, None], 0.0)
+                self.variances = np.maximum(squares.sum(axis=0) / counts, 1e-8)
+        return self
+
+    def smooth(self, observations, timestamps):
+        """Smoothed means and variances of the latent temperature at every step"""
+        return rts_smoother(observations, self.biases, self.variances, self.step_variances(timestamps))
+
+
+def smooth_dense(dense, smoother, z=1.96):
+    """State estimate of every read cycle of DenseTemperatures with a +- z standard deviation band"""
+    means, variances = smoother.smooth(dense.values, dense.cycle_timestamps)
+    std = np.sqrt(variances)
+    return pd.DataFrame({'ID': dense.cycle_ids, 'TIMESTAMP': dense.cycle_timestamps, 'estimate': means,
+                         'std': std, 'lower': means - z * std, 'upper': means + z * std})
+
+
+def kalman_smooth(temperature_data, process_variance=1e-3, biases=None, variances=None):
+    """
+    smooth_dense of the read cycles of a TemperatureData, cached on the object per parameter set. process_variance
+    is in °C² per minute, unknown sensor biases and variances are fitted on this recording.
+    """
+    parameters = (process_variance, None if biases is None else tuple(biases),
+                  None if variances is None else tuple(variances))
+    if temperature_data.state_space_parameters != parameters:
+        dense = temperature_data.get_dense_data()
+        smoother = StateSpaceSmoother(process_variance, biases, variances)
+        smoother.fit(dense.values, dense.cycle_timestamps)
+        temperature_data.state_space_data = smooth_dense(dense, smoother)
+        temperature_data.state_space_parameters = parameters
+    return temperature_data.state_space_data
@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+
+from common.src.parallel import map_ordered
+
+
+def subset_masks(n_sensors, max_size=None):
+    """Every non-empty subset of the sensors as a row of booleans, smaller subsets first"""
+    codes = np.arange(1, 2 ** n_sensors)
+    masks = ((codes[:, None] >> np.arange(n_sensors)) & 1).astype(bool)
+    sizes = masks.sum(axis=1)
+    if max_size is not None:
+        masks, sizes = masks[sizes <= max_size], sizes[sizes <= max_size]
+    return masks[np.argsort(sizes, kind='stable')]
+
+
+class SubsetStatistics:
+    """
+    Sufficient statistics of the sensor errors against the ground truth: per participant the number of cells,
+    the sum of the error vectors and the sum of their outer products. Any weighted combination of any subset is
+    evaluated from these in O(k²), and a participant is left out by subtracting its own statistics.
+    """
+
+    def __init__(self, errors, groups):
+        errors = np.asarray(errors, dtype=np.float64)
+        groups = np.asarray(groups)
+        valid = np.isfinite(errors).all(axis=1)  # a cell needs every sensor
+        errors, groups = errors[valid], groups[valid]
+        self.participants = pd.unique(groups)
+        n_sensors = errors.shape[1]
+
+        self.counts = np.zeros(len(self.participants))
+        self.sums = np.zeros((len(self.participants), n_sensors))
+        self.products = np.zeros((len(self.participants), n_sensors, n_sensors))
+        for i, participant in enumerate(self.participants):
+            rows = errors[groups == participant]
+            self.counts[i] = len(rows)
+            self.sums[i] = rows.sum(axis=0)
+            self.products[i] = rows.T @ rows
+
+    @classmethod
+    def from_phase_statistics(cls, phase_statistics, phases):
+        """Cells are (participant, phase) like in analyze_mean_error, the error is the phase mean - ground truth"""
+        errors = np.concatenate([phase_statistics.get('gt_error', phase) for phase in phases])
+        groups = np.tile(np.arange(len(phase_statistics.source_filenames)), len(phases))
+        return cls(errors, groups)
+
+    def moments(self, exclude=None):
+        counts, sums, products = self.counts.sum(), self.sums.sum(axis=0), self.products.sum(axis=0)
+        if exclude is not None:
+            counts -= self.counts[exclude]
+            sums = sums - self.sums[exclude]
+            products = products - self.products[exclude]
+        return sums / counts, products / counts
+
+
+def subset_weights(mean, second_moment, mask, weighting):
+    """Weights and bias correction of one subset, 'mean' averages the raw sensors, 'blue' fits both"""
+    if weighting == 'mean':
+        return np.full(mask.sum(), 1.0 / mask.sum()), np.zeros(mask.sum())
+    if weighting != 'blue':
+        raise ValueError(f"Unknown weighting {weighting!r}")
+    bias = mean[mask]
+    covariance = second_moment[np.ix_(mask, mask)] - np.outer(bias, bias)
+    inverse_ones = np.linalg.lstsq(covariance, np.ones(mask.sum()), rcond=None)[0]
+    return inverse_ones / inverse_ones.sum(), bias
+
+
+def squared_error(weights, bias, mean, second_moment):
+    """Mean of (w'(e - b))² from the first and second moment of e, restricted to the subset already"""
+    centered = second_moment - np.outer(mean, bias) - np.outer(bias, mean) + np.outer(bias, bias)
+    return float(weights @ centered @ weights)
+
+
+def participant_moments(statistics):
+    """First and second moment of every participant's own cells"""
+    return [(sums / count, products / count)
+            for count, sums, products in zip(statistics.counts, statistics.sums, statistics.products)]
+
+
+def error_floor(mask, own_moments):
+    """
+    Lower bound of the mean over the participants of the squared error of any combination of the subset's sensors
+    whose weights sum to 1, whatever its bias correction: per participant the smallest w'Σw of its own covariance
+    Σ. Removing sensors only shrinks the feasible weights, so the bound also holds for every subset of mask.
+    """
+    floors = []
+    for own_mean, own_second in own_moments:
+        covariance = own_second[np.ix_(mask, mask)] - np.outer(own_mean[mask], own_mean[mask])
+        ones = np.ones(mask.sum())
+        solution = np.linalg.pinv(covariance) @ ones
+        # Without 1 in the range of Σ some weights summing to 1 have no variance at all
+        in_range = np.allclose(covariance @ solution, ones, atol=1e-8)
+        floors.append(1.0 / (ones @ solution) if in_range and ones @ solution > 0 else 0.0)
+    return float(np.mean(floors))
+
+
+def subset_scores(mask, weighting, moments, held_out, own_moments):
+    """RMSE, mean error and leave-one-participant-out RMSE of one subset"""
+    mean, second_moment = moments
+    weights, bias = subset_weights(mean, second_moment, mask, weighting)
+    rmse = np.sqrt(squared_error(weights, bias, mean[mask], second_moment[np.ix_(mask, mask)]))
+    mean_error = weights @ (mean[mask] - bias)
+
+    # Fitted on all other participants, evaluated on the left out one, each participant counts the same
+    errors = []
+    for (fit_mean, fit_second), (own_mean, own_second) in zip(held_out, own_moments):
+        fold_weights, fold_bias = subset_weights(fit_mean, fit_second, mask, weighting)
+        errors.append(squared_error(fold_weights, fold_bias, own_mean[mask], own_second[np.ix_(mask, mask)]))
+    return rmse, mean_error, np.sqrt(np.mean(errors))
+
+
+def evaluate_subsets(chunk, statistics, masks, weighting):
+    """RMSE, mean error and leave-one-participant-out RMSE of every subset, from the sufficient statistics only"""
+    moments = statistics.moments()
+    held_out = [statistics.moments(exclude=i) for i in range(len(statistics.participants))]
+    own_moments = participant_moments(statistics)
+    results = np.full((len(masks), 3), np.nan)
+    for row, mask in enumerate(masks):
+        results[row] = subset_scores(mask, weighting, moments, held_out, own_moments)
+    return results
+
+
+def evaluate_in_chunks(statistics, masks, weighting, num_workers=1, chunks=None):
+    """evaluate_subsets over chunks of masks in num_workers processes, a failed chunk raises"""
+    chunks = chunks or max(num_workers, 1)
+    jobs = [(i, statistics, part, weighting) for i, part in enumerate(np.array_split(masks, chunks)) if len(part)]
+    if not jobs:
+        return np.empty((0, 3))
+    return np.concatenate(map_ordered(evaluate_subsets, jobs, num_workers, skip_errors=False))
+
+
+def pruned_subsets(statistics, n_sensors, weighting, max_size=None, num_workers=1, chunks=None):
+    """
+    Branch and bound over the subsets for the Pareto set: for every size k the best subset, if it beats every
+    smaller subset. Subsets of size k are reached by removing sensors from the full set, and a branch is cut as
+    soon as the error_floor of its set cannot beat the best smaller subset. The surviving subsets of a size are
+    evaluated together, in chunks like the exhaustive search.
+    Returns the masks that were evaluated and their scores, every Pareto subset is among them.
+    """
+    own_moments = participant_moments(statistics)
+    floors = {}
+
+    def floor(mask):
+        key = mask.tobytes()
+        if key not in floors:
+            floors[key] = np.sqrt(error_floor(mask, own_moments))
+        return floors[key]
+
+    all_masks = []
+    all_results = []
+    best_smaller = np.inf
+    for size in range(1, (max_size or n_sensors) + 1):
+        candidates = []
+        # Depth first, a branch only removes sensors after the last one it removed, so every set is visited once
+        stack = [(np.ones(n_sensors, dtype=bool), 0)]
+        while stack:
+            mask, first = stack.pop()
+            if floor(mask) >= best_smaller:
+                continue
+            if mask.sum() == size:
+                candidates.append(mask)
+                continue
+            for sensor in range(first, n_sensors):
+                if mask[sensor]:
+                    child = mask.copy()
+                    child[sensor] = False
+                    stack.append((child, sensor + 1))
+        if not candidates:
+            continue
+        masks = np.array(candidates, dtype=bool)
+        results = evaluate_in_chunks(statistics, masks, weighting, num_workers, chunks)
+        all_masks.append(masks)
+        all_results.append(results)
+        best_smaller = min(best_smaller, results[:, 2].min())
+
+    if not all_masks:
+        return np.empty((0, n_sensors), dtype=bool), np.empty((0, 3))
+    return np.concatenate(all_masks), np.concatenate(all_results)
+
+
+def search_subsets(statistics, columns, weighting='mean', max_size=None, num_workers=1, chunks=None, prune=False):
+    """
+    Ranks subsets of the sensors by held-out RMSE and then by sensor count. Pareto marks the subsets which beat
+    every subset with fewer sensors, the candidates worth looking at for a production earable. Chunks of subsets
+    are evaluated in num_workers processes and a failed chunk raises so no score is paired with the wrong subset.
+    With prune only the subsets pruned_subsets evaluates are ranked, the Pareto set is the same as that of the
+    exhaustive search. The floor only prunes when participants have more cells than the subset has sensors, with one
+    cell per participant and phase like in study 1 it is 0 and every subset is evaluated anyway.
+    For six sensors the 63 subsets cost less than starting a process, num_workers > 1 only pays off for many more
+    sensors.
+    """
+    if prune:
+        masks, results = pruned_subsets(statistics, len(columns), weighting, max_size, num_workers, chunks)
+    else:
+        masks = subset_masks(len(columns), max_size)
+        results = evaluate_in_chunks(statistics, masks, weighting, num_workers, chunks)
+
+    table = pd.DataFrame({
+        'Sensors': [', '.join(np.asarray(columns)[mask]) for mask in masks],
+        'n_sensors': masks.sum(axis=1),
+        'RMSE': results[:, 0],
+        'Mean_Error': results[:, 1],
+        'Held_out_RMSE': results[:, 2],
+    })
+    best_smaller = table.groupby('n_sensors')['Held_out_RMSE'].min().cummin().shift(1, fill_value=np.inf)
+    table['Pareto'] = table['Held_out_RMSE'] < table['n_sensors'].map(best_smaller)
+    table['Pareto'] &= table['Held_out_RMSE'] == table.groupby('n_sensors')['Held_out_RMSE'].transform('min')
+    return table.sort_values(['Held_out_RMSE', 'n_sensors'], kind='stable').reset_index(drop=True)
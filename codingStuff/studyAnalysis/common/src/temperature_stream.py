@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+
+from common.src.binary_log import RECORD_DTYPE, is_binary_log, iter_binary_log
+from common.src.log_cache import TEMP_COLUMNS, prepare_log_frame
+from common.src.sd_log_reader import DEFAULT_CHUNK_SIZE, SDLogReader
+from common.src.smoothing import rolling_mean
+
+
+def iter_log_blocks(file_path, temp_columns=TEMP_COLUMNS, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields a CSV or binary log in blocks of about chunk_size bytes of input, prepared like load_earable_log does:
+    zeros replaced with NaN and temperatures scaled to °C. The index counts the rows of the whole recording.
+    """
+    if is_binary_log(file_path):
+        blocks = iter_binary_log(file_path, max(chunk_size // RECORD_DTYPE.itemsize, 1))
+    else:
+        reader = SDLogReader(file_path, chunk_size=chunk_size)
+        blocks = (pd.DataFrame(rows, columns=reader.columns).astype({'TIMESTAMP': 'int64'}) for rows in reader)
+
+    offset = 0
+    for block in blocks:
+        block.index = pd.RangeIndex(offset, offset + len(block))
+        offset += len(block)
+        yield prepare_log_frame(block, temp_columns)
+
+    if not is_binary_log(file_path) and reader.truncated:
+        print(f"Dropped the incomplete last row of {file_path}")
+
+
+class RollingMeanStream:
+    """Gives the same result as rolling_mean over the whole recording with a window of rows, block by block"""
+
+    def __init__(self, window):
+        self.window = window
+        self.tail = None
+
+    def update(self, block):
+        combined = block if self.tail is None else pd.concat([self.tail, block])
+        means = rolling_mean(combined.to_numpy(dtype=np.float64), self.window)[len(combined) - len(block):]
+        smoothed = pd.DataFrame(means, columns=block.columns, index=block.index)
+        # Only the last window - 1 rows are needed to continue with the next block
+        self.tail = combined.iloc[len(combined) - min(self.window - 1, len(combined)):]
+        return smoothed
+
+
+class RunningStatistics:
+    """
+    Count, mean, standard deviation, min and max per group and column which are merged block by block with the
+    pairwise update of Chan et al., so the values of a group never need to be in memory at once. NaN is skipped
+    like pandas does, the standard deviation uses ddof=0 like np.std in the analyzers and PhaseStatistics.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.groups = {}  # group -> [count, mean, m2, min, max], each an array over the columns
+
+    def update(self, values, groups=None):
+        values = np.asarray(values, dtype=np.float64)
+        if groups is None:
+            self.merge(None, values)
+            return
+        groups = np.asarray(groups)
+        for group in pd.unique(groups):
+            self.merge(group, values[groups == group])
+
+    def merge(self, group, values):
+        valid = np.isfinite(values)
+        count = valid.sum(axis=0)
+        mean = np.where(valid, values, 0).sum(axis=0) / np.maximum(count, 1)
+        m2 = (np.where(valid, values - mean, 0) ** 2).sum(axis=0)
+        minimum = np.where(valid, values, np.inf).min(axis=0, initial=np.inf)
+        maximum = np.where(valid, values, -np.inf).max(axis=0, initial=-np.inf)
+
+        if group not in self.groups:
+            self.groups[group] = [count, mean, m2, minimum, maximum]
+            return
+        count_a, mean_a, m2_a, min_a, max_a = self.groups[group]
+        total = count_a + count
+        delta = mean - mean_a
+        share = count / np.maximum(total, 1)
+        self.groups[group] = [
+            total,
+            mean_a + delta * share,
+            m2_a + m2 + delta ** 2 * count_a * share,
+            np.minimum(min_a, minimum),
+            np.maximum(max_a, maximum),
+        ]
+
+    def to_dataframe(self):
+        rows = []
+        for group, (count, mean, m2, minimum, maximum) in self.groups.items():
+            empty = count == 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                std = np.sqrt(m2 / count)
+            std[empty] = np.nan
+            for i, column in enumerate(self.columns):
+                rows.append({
+                    'Group': group,
+                    'Sensor': column,
+                    'count': int(count[i]),
+                    'mean': np.nan if empty[i] else mean[i],
+                    'std': std[i],
+                    'min': np.nan if empty[i] else minimum[i],
+                    'max': np.nan if empty[i] else maximum[i],
+                })
+        return pd.DataFrame(rows, columns=['Group', 'Sensor', 'count', 'mean', 'std', 'min', 'max'])
+
+
+class TemperatureStream:
+    """
+    Bounded memory counterpart of TemperatureData for recordings which do not fit into memory. The log is read block
+    by block and handed out in windows of window_minutes, smoothing and statistics carry over between windows.
+    TIMESTAMP is in minutes since the first sample.
+    """
+
+    def __init__(self, file_path, temp_columns=TEMP_COLUMNS, window_minutes=60.0, smoothing_window=120,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.file_path = file_path
+        self.temp_columns = list(temp_columns)
+        self.window_minutes = window_minutes
+        self.smoothing_window = smoothing_window
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        self.phase_statistics = RunningStatistics(self.temp_columns)
+        self.sensor_statistics = RunningStatistics(self.temp_columns)
+        self.mean_temp_statistics = RunningStatistics(['mean_temp'])
+        self.n_rows = 0
+
+    def iter_windows(self):
+        """Yields (raw, smoothed) DataFrames for each time window, smoothed holds ID, TIMESTAMP and temperatures"""
+        self.reset()
+        smoother = RollingMeanStream(self.smoothing_window)
+        first_timestamp = None
+        pending = None
+
+        for block in iter_log_blocks(self.file_path, self.temp_columns, self.chunk_size):
+            if first_timestamp is None:
+                first_timestamp = float(block['TIMESTAMP'].iloc[0])
+            # As float, the uint32 TIMESTAMP of binary logs would wrap around for an earlier sample
+            block['TIMESTAMP'] = (block['TIMESTAMP'].to_numpy(dtype=np.float64) - first_timestamp) / 1000.0 / 60.0
+            pending = block if pending is None else pd.concat([pending, block])
+
+            # Every run of rows in the same window except the last one is complete
+            window = np.floor(pending['TIMESTAMP'].to_numpy() / self.window_minutes)
+            starts = np.flatnonzero(np.diff(window) != 0) + 1
+            if len(starts):
+                bounds = np.concatenate(([0], starts))
+                for start, end in zip(bounds[:-1], bounds[1:]):
+                    yield self.process_window(pending.iloc[start:end], smoother)
+                pending = pending.iloc[starts[-1]:]
+
+        if pending is not None and len(pending):
+            yield self.process_window(pending, smoother)
+
+    def process_window(self, raw, smoother):
+        temperatures = raw[self.temp_columns].to_numpy(dtype=np.float64)
+        self.phase_statistics.update(temperatures, raw['ID'].to_numpy())
+        self.sensor_statistics.update(temperatures)
+
+        valid = np.isfinite(temperatures)
+        n_valid = valid.sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            mean_temp = np.where(valid, temperatures, 0).sum(axis=1) / n_valid
+        self.mean_temp_statistics.update(mean_temp[:, None])
+        self.n_rows += len(raw)
+
+        smoothed = smoother.update(raw[self.temp_columns])
+        smoothed.insert(0, 'TIMESTAMP', raw['TIMESTAMP'])
+        smoothed.insert(0, 'ID', raw['ID'])
+        return raw, smoothed
+
+    def run(self):
+        """Reads the whole recording once to compute the statistics"""
+        for _ in self.iter_windows():
+            pass
+        return self
+
+    def get_phase_statistics(self):
+        return self.phase_statistics.to_dataframe().rename(columns={'Group': 'ID'})
+
+    def get_sensor_statistics(self):
+        return self.sensor_statistics.to_dataframe().drop(columns='Group')
+
+    def get_mean_temp_statistics(self):
+        # Statistics of the per-row mean over the sensors, TemperatureData.mean_temp of the whole recording,
+        # all NaN before run()
+        return self.mean_temp_statistics.to_dataframe().drop(columns=['Group', 'Sensor']).reindex([0]).iloc[0]
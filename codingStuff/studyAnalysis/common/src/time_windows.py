@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from common.src.smoothing import parse_window, rolling_mean
+
+
+class TimeIndex:
+    """
+    Windows in seconds over a non-decreasing TIMESTAMP column, so results do not depend on the effective sample
+    rate of a device. Window bounds are found by binary search, so the cost does not grow with the window.
+    seconds_per_unit converts the timestamps into seconds, e.g. 60 for the minutes used by TemperatureData.
+    """
+
+    def __init__(self, timestamps, seconds_per_unit=1.0):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        if np.any(np.diff(self.timestamps) < 0):
+            raise ValueError("Timestamps must be non-decreasing")
+        self.seconds_per_unit = seconds_per_unit
+        self.seconds = self.timestamps * seconds_per_unit
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @staticmethod
+    def to_seconds(span):
+        kind, size = parse_window(span)
+        if kind != 'seconds':
+            raise ValueError(f"Expected a time span like '60s', got {span!r}")
+        return size
+
+    def rolling_mean(self, values, window, min_periods=1):
+        """Mean over the trailing window (t - window, t], window is a time span like '5s' or a number of rows"""
+        return rolling_mean(values, window, min_periods, self.seconds)
+
+    def diff(self, values, period):
+        """Change against the last value at least period before each row, NaN where there is none"""
+        values = np.asarray(values, dtype=np.float64)
+        previous = np.searchsorted(self.seconds, self.seconds - self.to_seconds(period), side='right') - 1
+        has_previous = previous >= 0
+        result = np.full(values.shape, np.nan)
+        result[has_previous] = values[has_previous] - values[previous[has_previous]]
+        return result
+
+    def bin_edges(self, interval):
+        step = self.to_seconds(interval)
+        if len(self.seconds) == 0:
+            return np.empty(0), step
+        start = np.floor(self.seconds[0] / step) * step
+        n_bins = int(np.floor((self.seconds[-1] - start) / step)) + 1
+        return start + step * np.arange(n_bins + 1), step
+
+    def resample(self, values, interval):
+        """
+        NaN skipping means of values in consecutive bins of interval, returns the bin start times in the unit of
+        the timestamps and the means. Bins without a valid value are NaN.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        squeeze = values.ndim == 1
+        if squeeze:
+            values = values[:, None]
+        edges, step = self.bin_edges(interval)
+        n_bins = max(len(edges) - 1, 0)
+        bins = np.searchsorted(edges, self.seconds, side='right') - 1
+
+        valid = ~np.isnan(values)
+        means = np.empty((n_bins, values.shape[1]))
+        for i in range(values.shape[1]):
+            sums = np.bincount(bins, weights=np.where(valid[:, i], values[:, i], 0), minlength=n_bins)
+            counts = np.bincount(bins, weights=valid[:, i], minlength=n_bins)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[:, i] = sums / counts
+        times = edges[:-1] / self.seconds_per_unit
+        return times, means[:, 0] if squeeze else means
+
+    def resample_frame(self, df, columns, interval):
+        times, means = self.resample(df[columns].to_numpy(dtype=np.float64), interval)
+        resampled = pd.DataFrame(means, columns=columns)
+        resampled.insert(0, 'TIMESTAMP', times)
+        return resampled
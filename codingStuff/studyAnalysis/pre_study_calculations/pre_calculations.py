@@ -1,4 +1,5 @@
 # Description: This file contains the pre-calculations for the study
+import os
 from src.explorative_plot import ExplorativePlot
 from src.explorative_plot_concat import ExplorativePlotConcat
 from src.explorative_plot_incl_offset import ExplorativePlotInclOffset
@@ -28,7 +29,8 @@ class PreCalculations:
         ]
         temp_columns = ['TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle']
         # Create and run the pipeline
-        pipeline = CalibrationPipeline(file_paths, temp_columns, 'target/fit_parameters.json')
+        pipeline = CalibrationPipeline(file_paths, temp_columns, 'target/fit_parameters.json',
+                                       num_workers=os.cpu_count())
         pipeline.run_pipeline()
 
 
@@ -3,12 +3,17 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.metrics import mean_absolute_error
 import json
+import os
+from common.src.calibration_cv import leave_one_group_out, summarize_folds
+from common.src.calibration_metrics import calibration_metrics
+from common.src.deinterleaver import deinterleave_frame
+from common.src.log_cache import load_earable_log
+from common.src.polynomial_fit import PolynomialFit
 
 
 class CalibrationPipeline:
-    def __init__(self, file_paths, temp_columns, json_path):
+    def __init__(self, file_paths, temp_columns, json_path, num_workers=1):
         self.file_paths = file_paths
         self.temp_columns = temp_columns
         self.concatenated_df = None
@@ -18,46 +23,31 @@ class CalibrationPipeline:
         self.mae_values = {}
         self.correlation_values = {}
         self.mae_and_variance = {}
+        self.metrics = None
+        self.file_ids = None
+        self.cv_metrics = None
+        self.cv_summary = None
+        self.num_workers = num_workers  # > 1 runs the cross-validation folds in that many processes
         self.json_path = json_path
+        self.selected_degrees = [2, 4, 8, 16, 32]
+        self.fit = None
+        self.fit_parameters = None
 
     def read_and_concatenate_data(self):
         self.concatenated_df = pd.DataFrame()
+        file_ids = []
         for file_path in self.file_paths:
-            df = pd.read_csv(file_path)
-            # if first row temp_colums have a value equal to 0, then we have to remove the first 6 rows
-            if df[self.temp_columns].iloc[0].sum() <= 4000:
-                # Make sure we only keep complete sets of 6 rows
-                num_rows_to_keep = len(df) // 6 * 6
-                df = df.iloc[:num_rows_to_keep]
-
-                df['MEAN_TIMESTAMP'] = (df['TIMESTAMP'].groupby(df.index // 6).transform('mean') / 6).astype('int64')
-                majority_ids = df['ID'].groupby(df.index // 6).transform(lambda x: x.value_counts().idxmax())
-
-                df = df.groupby(df.index // 6).apply(lambda x: x.sum())
-
-                # Calculate the mean TIMESTAMP and use the most frequent ID
-                df['TIMESTAMP'] = df['MEAN_TIMESTAMP']
-                # df['ID'] = np.around(df['MAJORITY_ID']).astype('int') / 6
-                df['ID'] = majority_ids.groupby(majority_ids.index // 6).first()
-
-                df.drop([
-                    'MEAN_TIMESTAMP',
-                    'ACC_X',
-                    'ACC_Y',
-                    'ACC_Z',
-                    'GYRO_X',
-                    'GYRO_Y',
-                    'GYRO_Z',
-                    'MAG_X',
-                    'MAG_Y',
-                    'MAG_Z'
-                ], axis=1, inplace=True)
-
-                # modified_file_path = os.path.splitext(file_path)[0] + "_modified.csv"
-                # df.to_csv(modified_file_path, index=False)
-
-            df[self.temp_columns] = df[self.temp_columns] / 100
+            # Raw values are needed here, the zeros mark the sensors which were not read in a row. The bench
+            # recordings are never gated, they need no motion mask
+            df = load_earable_log(file_path, self.temp_columns, replace_zeros=False, scale=False, motion_mask=False)
+            # Pack the round-robin rows into one row per read cycle, rows of files which hold all sensors
+            # at once stay one cycle each
+            df = deinterleave_frame(df, self.temp_columns).to_dataframe()
+            df[self.temp_columns] = df[self.temp_columns].astype('float64') / 100
             self.concatenated_df = pd.concat([self.concatenated_df, df[self.temp_columns]], ignore_index=True)
+            file_ids.append(np.repeat(os.path.basename(file_path), len(df)))
+        # Source recording of every row, the folds of the cross-validation
+        self.file_ids = np.concatenate(file_ids) if file_ids else np.empty(0, dtype=str)
 
     def plot_raw_data(self):
         plt.figure()
@@ -71,46 +61,52 @@ class CalibrationPipeline:
     def smooth_data(self):
         window_size = int(len(self.concatenated_df.index) / 50)
         min_periods = int(len(self.concatenated_df.index) / 200)
-        self.smoothed_data = self.concatenated_df[self.temp_columns].rolling(window=window_size,
-                                                                             min_periods=min_periods,
-                                                                             center=True).mean()
+        # Every recording is smoothed on its own, a centered window across a file border would mix two plateaus
+        # and let the held-out file of cross_validate see samples of the files it is fitted on
+        by_file = self.concatenated_df[self.temp_columns].groupby(self.file_ids, sort=False)
+        self.smoothed_data = by_file.rolling(window=window_size, min_periods=min_periods,
+                                             center=True).mean().droplevel(0).sort_index()
         self.mean_temp = self.smoothed_data.mean(axis=1)
 
     def apply_calibration(self):
-        selected_degrees = [2, 4, 8, 16, 32]
-        constant_calibrated = self.smoothed_data.copy()
+        smoothed_values = self.smoothed_data[self.temp_columns].to_numpy(dtype=np.float64)
         overall_mean = self.mean_temp.mean()  # Mean of the average temperature at each time point
 
+        # All sensors and degrees come from one fit, the linear fit is its degree 1
+        self.fit = PolynomialFit(smoothed_values, self.mean_temp.to_numpy(dtype=np.float64),
+                                 max(self.selected_degrees))
+
         self.fit_parameters = {
             'offsets': {},
             'linear': {},
-            'poly': {}
+            'poly': {},
+            'poly_error': {},
+            'chebyshev': {}
         }
 
-        for col in self.temp_columns:
-            curve_mean = self.smoothed_data[col].mean()  # Mean of this particular curve
-            offset = overall_mean - curve_mean  # Offset to adjust this curve's mean to the overall mean
-            constant_calibrated[col] = self.smoothed_data[col] + offset  # Apply the offset
-            self.fit_parameters['offsets'][col] = offset
+        # Offset to adjust each curve's mean to the overall mean
+        offsets = overall_mean - self.smoothed_data[self.temp_columns].mean()
+        self.calibrated_data_dict['Constant'] = self.smoothed_data[self.temp_columns] + offsets
+        self.fit_parameters['offsets'] = offsets.to_dict()
 
-        self.calibrated_data_dict['Constant'] = constant_calibrated
         linear_calibrated = self.smoothed_data.copy()
-
-        for col in self.temp_columns:
-            slope, intercept = np.polyfit(self.smoothed_data[col].dropna(), self.mean_temp.dropna(), 1)
-            linear_calibrated[col] = slope * self.smoothed_data[col] + intercept
+        linear_calibrated[self.temp_columns] = self.fit.evaluate(smoothed_values, 1)
+        for col, (slope, intercept) in zip(self.temp_columns, self.fit.power_coefficients(1)):
             self.fit_parameters['linear'][col] = {'Slope': slope, 'Intercept': intercept}
-
         self.calibrated_data_dict['Linear'] = linear_calibrated
 
-        for degree in selected_degrees:
+        for degree in self.selected_degrees:
             poly_calibrated = self.smoothed_data.copy()
-            self.fit_parameters['poly'][str(degree)] = {}
-            for col in self.temp_columns:
-                np_polyfit = np.polyfit(self.smoothed_data[col].dropna(), self.mean_temp.dropna(), degree)
-                poly_calibrated[col] = np.polyval(np_polyfit, self.smoothed_data[col])
-                self.fit_parameters['poly'][str(degree)][col] = np_polyfit.tolist()
+            poly_calibrated[self.temp_columns] = self.fit.evaluate(smoothed_values, degree)
+            self.fit_parameters['poly'][str(degree)] = {
+                col: coefficients.tolist() for col, coefficients in zip(self.temp_columns,
+                                                                        self.fit.power_coefficients(degree))}
+            self.fit_parameters['poly_error'][str(degree)] = dict(zip(self.temp_columns,
+                                                                      self.fit.power_form_error(degree)))
+            self.fit_parameters['chebyshev'][str(degree)] = dict(zip(self.temp_columns,
+                                                                     self.fit.chebyshev_parameters(degree)))
             self.calibrated_data_dict[f'Poly_{degree}'] = poly_calibrated
+        self.metrics = None
 
     def plot_calibrated_data(self):
         for name, calibrated_data in self.calibrated_data_dict.items():
@@ -122,18 +118,24 @@ class CalibrationPipeline:
             plt.legend(self.temp_columns)
             plt.savefig(f"target/concatenated_fit_{name}.png")
 
+    def calculate_metrics(self):
+        # One table of all methods and sensors on a shared validity mask, the reporting and plotting steps read it
+        calibrated = np.stack([calibrated_data[self.temp_columns].to_numpy(dtype=np.float64)
+                               for calibrated_data in self.calibrated_data_dict.values()])
+        self.metrics = calibration_metrics(self.mean_temp.to_numpy(dtype=np.float64), calibrated,
+                                           self.calibrated_data_dict.keys(), self.temp_columns)
+        return self.metrics
+
+    def get_metrics(self):
+        if self.metrics is None:
+            self.calculate_metrics()
+        return self.metrics
+
     def calculate_mae(self):
-        for name, calibrated_data in self.calibrated_data_dict.items():
-            mae = np.mean([mean_absolute_error(self.mean_temp.dropna(), calibrated_data[col].dropna()) for col in
-                           self.temp_columns])
-            self.mae_values[name] = mae
+        self.mae_values = self.get_metrics()['MAE'].groupby(level='Method', sort=False).mean().to_dict()
 
     def plot_mae_boxplot(self):
-        mae_list_by_method = {}
-        for name, calibrated_data in self.calibrated_data_dict.items():
-            mae_list = [mean_absolute_error(self.mean_temp.dropna(), calibrated_data[col].dropna()) for col in
-                        self.temp_columns]
-            mae_list_by_method[name] = mae_list
+        mae_list_by_method = self.get_metrics()['MAE'].groupby(level='Method', sort=False).apply(list).to_dict()
         plt.figure()
         plt.boxplot(mae_list_by_method.values(), labels=mae_list_by_method.keys())
         plt.title('Boxplot of MAE by Calibration Method')
@@ -142,17 +144,28 @@ class CalibrationPipeline:
         plt.savefig("target/concatenated_box_plot.png")
 
     def calculate_correlation(self):
-        for name, calibrated_data in self.calibrated_data_dict.items():
-            correlation = np.mean([calibrated_data[col].corr(self.mean_temp) for col in self.temp_columns])
-            self.correlation_values[name] = correlation
+        correlation = self.get_metrics()['Correlation'].groupby(level='Method', sort=False)
+        self.correlation_values = correlation.mean().to_dict()
 
     def calculate_mae_and_variance(self):
-        for name, calibrated_data in self.calibrated_data_dict.items():
-            mae = np.mean([mean_absolute_error(self.mean_temp.dropna(), calibrated_data[col].dropna()) for col in
-                           self.temp_columns])
-            variance = np.var([mean_absolute_error(self.mean_temp.dropna(), calibrated_data[col].dropna()) for col in
-                               self.temp_columns])
-            self.mae_and_variance[name] = {'MAE': mae, 'Variance': variance}
+        # Variance of the per-sensor MAE of each method, like np.var over the sensors
+        mae = self.get_metrics()['MAE'].groupby(level='Method', sort=False)
+        self.mae_and_variance = {name: {'MAE': values.mean(), 'Variance': values.var(ddof=0)} for name, values in mae}
+
+    def cross_validate(self):
+        # Leaves out one recording (temperature plateau) at a time, so the methods are compared on data they
+        # were not fitted on. smooth_data smooths every recording separately, so no fold sees another's samples.
+        self.cv_metrics = leave_one_group_out(self.smoothed_data[self.temp_columns].to_numpy(dtype=np.float64),
+                                              self.mean_temp.to_numpy(dtype=np.float64), self.file_ids,
+                                              self.selected_degrees, self.temp_columns, self.num_workers)
+        self.cv_summary = summarize_folds(self.cv_metrics)
+        return self.cv_metrics
+
+    def select_method(self, metric='MAE'):
+        """Calibration method with the lowest held-out error"""
+        if self.cv_summary is None:
+            self.cross_validate()
+        return self.cv_summary[1][metric].idxmin()
 
     def plot_all_fits_together(self):
         # Create a subplot layout
@@ -188,38 +201,44 @@ class CalibrationPipeline:
         fit_parameters = {
             'precomputed_offsets': self.fit_parameters.get('offsets', {}),
             'precomputed_params': self.fit_parameters.get('linear', {}),
-            'coefficients': self.fit_parameters.get('poly', {})
+            # The polynomials: Chebyshev series on x scaled from domain to [-1, 1], numerically stable
+            'chebyshev': self.fit_parameters.get('chebyshev', {}),
+            # Legacy power form for old readers only, inaccurate at high degrees by up to coefficients_max_error °C
+            'coefficients': self.fit_parameters.get('poly', {}),
+            'coefficients_max_error': self.fit_parameters.get('poly_error', {}),
+            'polynomial_format': 'chebyshev'
         }
+        if self.cv_summary is not None:
+            # The method with the lowest held-out error, CalibrationModel.from_json uses it by default
+            fit_parameters['selected_method'] = self.select_method()
+            fit_parameters['held_out_MAE'] = self.cv_summary[1]['MAE'].to_dict()
 
         # Save to JSON file
         with open(json_path, 'w') as file:
             json.dump(fit_parameters, file)
 
-
     def print_fit_parameters(self):
+        # Prints the cached fits of apply_calibration instead of fitting again
+        if self.fit_parameters is None:
+            self.apply_calibration()
         print("Fit Parameters:")
 
         # Constant Fit (it's just an offset, so one parameter)
         print("\nConstant Fit:")
-        overall_mean = self.mean_temp.mean()
-        for col in self.temp_columns:
-            curve_mean = self.smoothed_data[col].mean()
-            offset = overall_mean - curve_mean
+        for col, offset in self.fit_parameters['offsets'].items():
             print(f"{col}: Offset = {offset}")
 
         # Linear Fit (two parameters: slope and intercept)
         print("\nLinear Fit:")
-        for col in self.temp_columns:
-            slope, intercept = np.polyfit(self.smoothed_data[col].dropna(), self.mean_temp.dropna(), 1)
-            print(f"{col}: Slope = {slope}, Intercept = {intercept}")
+        for col, parameters in self.fit_parameters['linear'].items():
+            print(f"{col}: Slope = {parameters['Slope']}, Intercept = {parameters['Intercept']}")
 
-        # Polynomial Fits (coefficients)
-        selected_degrees = [2, 4, 8, 16, 32]
-        for degree in selected_degrees:
+        # Polynomial Fits (Chebyshev coefficients on the domain scaled to [-1, 1])
+        for degree in self.selected_degrees:
             print(f"\nPolynomial Fit (degree {degree}):")
-            for col in self.temp_columns:
-                coefficients = np.polyfit(self.smoothed_data[col].dropna(), self.mean_temp.dropna(), degree)
-                print(f"{col}: Coefficients = {coefficients}")
+            for col, parameters in self.fit_parameters['chebyshev'][str(degree)].items():
+                print(f"{col}: Domain = {parameters['domain']}, "
+                      f"Chebyshev coefficients = {np.array(parameters['coefficients'])}")
 
     def run_pipeline(self):
         self.read_and_concatenate_data()
@@ -227,10 +246,12 @@ class CalibrationPipeline:
         self.smooth_data()
         self.apply_calibration()
         self.plot_calibrated_data()
+        self.calculate_metrics()
         self.calculate_mae()
         self.plot_mae_boxplot()
         self.calculate_correlation()
         self.calculate_mae_and_variance()
+        self.cross_validate()
         self.plot_all_fits_together()
         self.build_json_parameters(self.json_path)
         # self.print_fit_parameters()
@@ -238,3 +259,7 @@ class CalibrationPipeline:
         print("MAE values:", self.mae_values)
         print("Correlation values:", self.correlation_values)
         print("MAE and Variance:", self.mae_and_variance)
+        print(self.metrics)
+        print("Held-out errors (leave one recording out):")
+        print(self.cv_summary[1])
+        print("Selected method:", self.select_method())
@@ -4,23 +4,67 @@ import seaborn as sns
 import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
+from common.src.deinterleaver import deinterleave_frame
+from common.src.motion_artifacts import QUALITY_COLUMN, apply_quality_mask, quality_mask
+from common.src.phase_index import PhaseIndex
+from common.src.smoothing import smooth_frame
+from common.src.state_space import kalman_smooth
 
 
 class TemperatureData:
 
-    def __init__(self, df, temp_columns, source_filename, data_folder, target_folder, real_temp_ground_truth):
+    def __init__(self, df, temp_columns, source_filename, data_folder, target_folder, real_temp_ground_truth,
+                 scale_temperatures=True, motion_gating=False):
         self.raw_data = df
         self.real_temp_ground_truth = real_temp_ground_truth
         self.temp_columns = temp_columns
-        self.raw_data[temp_columns] = self.raw_data[temp_columns] / 100.0
+        if scale_temperatures:
+            self.raw_data[temp_columns] = self.raw_data[temp_columns] / 100.0
+        # True for samples without motion artifacts, taken from the (cached) log or computed while TIMESTAMP is
+        # still in milliseconds. motion_gating sets the temperatures of all other samples to NaN
+        if QUALITY_COLUMN in self.raw_data.columns:
+            self.motion_mask = self.raw_data.pop(QUALITY_COLUMN).to_numpy()
+        else:
+            self.motion_mask = quality_mask(self.raw_data)
+        if motion_gating:
+            apply_quality_mask(self.raw_data, temp_columns, self.motion_mask)
         self.raw_data['TIMESTAMP'] = (self.raw_data['TIMESTAMP'] - self.raw_data['TIMESTAMP'].min()) / 1000.0 / 60.0
         self.mean_temp = self.raw_data[temp_columns].mean(axis=1)
         self.source_filename = source_filename
         self.data_folder = data_folder
         self.target_folder = target_folder  # New attribute to store the target folder
+        self.dense_data = None
+        self.smoothed_data = None
+        self.smoothing_parameters = None
+        self.state_space_data = None
+        self.state_space_parameters = None
+        self.phase_index = PhaseIndex(self.raw_data['ID'].to_numpy())
 
-    def smooth_data(self):
-        self.smoothed_data = self.raw_data.rolling(window=120, min_periods=1).mean()
+    def get_phase_data(self, phases):
+        # Rows of one or more phases as a slice of raw_data instead of a boolean mask over all rows
+        return self.raw_data.iloc[self.phase_index.rows(phases)]
+
+    def get_phase_values(self, column, phases):
+        # NumPy view of one column within the phases, NaN is not removed
+        return self.phase_index.take(self.raw_data[column].to_numpy(), phases)
+
+    def get_dense_data(self):
+        # One row per read cycle of the round-robin read sensors instead of 5/6 NaN per column
+        if self.dense_data is None:
+            self.dense_data = deinterleave_frame(self.raw_data, self.temp_columns)
+        return self.dense_data
+
+    def smooth_data(self, window=120, min_periods=1):
+        # window is a number of rows or a time span like '60s', only the temperatures are smoothed
+        if self.smoothing_parameters != (window, min_periods):
+            self.smoothed_data = smooth_frame(self.raw_data, self.temp_columns, window, min_periods,
+                                              seconds_per_unit=60.0)
+            self.smoothing_parameters = (window, min_periods)
+        return self.smoothed_data
+
+    def kalman_smooth(self, process_variance=1e-3, biases=None, variances=None):
+        # Latent temperature of every read cycle with a 95% band, without the lag of the moving average
+        return kalman_smooth(self, process_variance, biases, variances)
 
     def plot_raw_data(self):
         # Mapping for renaming sensor labels
@@ -35,11 +79,11 @@ class TemperatureData:
 
         def add_background_color(ax):
             custom_colors = ["#CCCCE5", "#CCE5FF", "#E5FFE4", "#FFE9C9", "#FFFFFF", "#FFFFFF"]
-            unique_ids = self.raw_data['ID'].unique()
+            unique_ids = self.phase_index.phases
             # colors = sns.color_palette("husl", len(unique_ids))
             for i, unique_id in enumerate(unique_ids):
-                id_data = self.raw_data[self.raw_data['ID'] == unique_id]
-                ax.axvspan(id_data['TIMESTAMP'].min(), id_data['TIMESTAMP'].max(), facecolor=custom_colors[i], alpha=1)
+                id_timestamps = self.get_phase_values('TIMESTAMP', unique_id)
+                ax.axvspan(id_timestamps.min(), id_timestamps.max(), facecolor=custom_colors[i], alpha=1)
 
         source_filename_suffix = os.path.splitext(self.source_filename)[0]
         os.makedirs(self.data_folder, exist_ok=True)
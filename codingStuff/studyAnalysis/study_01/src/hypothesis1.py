@@ -5,41 +5,89 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
+from common.src.phase_statistics import PhaseStatistics
+from common.src.sensor_fusion import (FusionData, KalmanFusion, RidgeFusion, WeightedLeastSquaresFusion,
+                                     leave_one_participant_out, row_means)
+from common.src.subset_search import SubsetStatistics, search_subsets
 
 
 class Hypothesis1Analyzer:
-    def __init__(self, all_temp_data):
+    def __init__(self, all_temp_data, num_workers=1, phase_statistics=None):
         self.all_temp_data = all_temp_data
-
-    def boxplot(self):
-        # Initialize an empty DataFrame to hold delta temperatures for all sensors
-        delta_temp_df = pd.DataFrame(columns=['Sensor', 'Delta Temperature', 'ID'])
-
-        # Iterate through all calibration data objects
+        self.num_workers = num_workers
+        self.phase_statistics = phase_statistics  # PhaseStatistics shared by the analyzers, computed if None
+
+    def build_delta_temperature_table(self):
+        # Long format table of every reading minus the ground truth, filled into preallocated arrays once
+        temp_columns = self.all_temp_data[0].temp_columns
+        n_sensors = len(temp_columns)
+        n_rows = sum(len(temp_data.raw_data) for temp_data in self.all_temp_data) * n_sensors
+
+        deltas = np.empty(n_rows)
+        sensor_codes = np.empty(n_rows, dtype=np.int8)
+        ids = np.empty(n_rows, dtype=np.int64)
+        position = 0
         for temp_data in self.all_temp_data:
-            real_temp_ground_truth = temp_data.real_temp_ground_truth
-
-            for sensor in temp_data.temp_columns:
-                # Calculate delta temperature
-                delta_temp = temp_data.raw_data[sensor] - real_temp_ground_truth
+            n = len(temp_data.raw_data)
+            phase_ids = temp_data.raw_data['ID'].to_numpy()
+            for i, sensor in enumerate(temp_columns):
+                deltas[position:position + n] = temp_data.raw_data[sensor].to_numpy() - temp_data.real_temp_ground_truth
+                sensor_codes[position:position + n] = i
+                ids[position:position + n] = phase_ids
+                position += n
+
+        return pd.DataFrame({
+            'Sensor': pd.Categorical.from_codes(sensor_codes, categories=temp_columns),
+            'Delta Temperature': deltas,
+            'ID': pd.Categorical(ids, categories=pd.unique(ids)),
+        })
+
+    def box_statistics(self, values, max_fliers=1000):
+        # Same quartiles and 1.5 IQR whiskers as seaborn, only a random subset of the outliers is drawn
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return None
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        iqr = q3 - q1
+        whislo = values[values >= q1 - 1.5 * iqr].min()
+        whishi = values[values <= q3 + 1.5 * iqr].max()
+        fliers = values[(values < whislo) | (values > whishi)]
+        if len(fliers) > max_fliers:
+            fliers = np.random.default_rng(0).choice(fliers, max_fliers, replace=False)
+        return {'med': median, 'q1': q1, 'q3': q3, 'whislo': whislo, 'whishi': whishi, 'fliers': fliers}
 
-                # Create a temporary DataFrame
-                temp_df = pd.DataFrame({
-                    'Sensor': [sensor] * len(delta_temp),
-                    'Delta Temperature': delta_temp,
-                    'ID': temp_data.raw_data['ID']  # Assuming 'ID' is in raw_data
-                })
-
-                # Append to the main DataFrame
-                delta_temp_df = pd.concat([delta_temp_df, temp_df])
+    def boxplot(self):
+        delta_temp_df = self.build_delta_temperature_table()
+        n_sensors = len(delta_temp_df['Sensor'].cat.categories)
+
+        # Sort the readings by (phase, sensor) once instead of masking the table for every box. The category codes
+        # are as narrow as int8, so they are widened before the product could overflow
+        group_codes = (delta_temp_df['ID'].cat.codes.to_numpy().astype(np.int64) * n_sensors
+                       + delta_temp_df['Sensor'].cat.codes.to_numpy().astype(np.int64))
+        order = np.argsort(group_codes, kind='stable')
+        group_ends = np.cumsum(np.bincount(group_codes, minlength=len(delta_temp_df['ID'].cat.categories) * n_sensors))
+        sorted_deltas = delta_temp_df['Delta Temperature'].to_numpy()[order]
+        colors = sns.color_palette(n_colors=n_sensors)
 
         # Create boxplots for each phase
-        unique_phases = delta_temp_df['ID'].unique()
-        for phase in unique_phases:
-            phase_data = delta_temp_df[delta_temp_df['ID'] == phase]
+        for phase_code, phase in enumerate(delta_temp_df['ID'].cat.categories):
+            box_stats = []
+            positions = []
+            for sensor_code in range(n_sensors):
+                group = phase_code * n_sensors + sensor_code
+                start = group_ends[group - 1] if group > 0 else 0
+                stats_of_box = self.box_statistics(sorted_deltas[start:group_ends[group]])
+                if stats_of_box is not None:
+                    box_stats.append(stats_of_box)
+                    positions.append(sensor_code)
 
             plt.figure(figsize=(12, 6))
-            ax = sns.boxplot(x='Sensor', y='Delta Temperature', data=phase_data)
+            ax = plt.gca()
+            boxes = ax.bxp(box_stats, positions=positions, widths=0.8, patch_artist=True,
+                           flierprops={'marker': 'd', 'markersize': 5},
+                           medianprops={'color': '0.25'})
+            for box, position in zip(boxes['boxes'], positions):
+                box.set_facecolor(colors[position])
 
             new_labels = [
                 'Tympanic Membrane',
@@ -51,6 +99,7 @@ class Hypothesis1Analyzer:
             ]
             ax.set_xticks(range(len(new_labels)))
             ax.set_xticklabels(new_labels)
+            ax.set_xlim(-0.5, n_sensors - 0.5)
 
             plt.title(f"Delta Temperature for Different Sensors (Phase {phase})")
             plt.xlabel("")
@@ -68,7 +117,7 @@ class Hypothesis1Analyzer:
 
         for temp_data in self.all_temp_data:
             # Filter data for phases 2 and 3 and 4
-            phase_data = temp_data.raw_data[temp_data.raw_data['ID'].isin(phases)]
+            phase_data = temp_data.get_phase_data(phases)
 
             # Columns for behind the ear and in the ear
             behind_ear_columns = ['Out_Bottom', 'Out_Top', 'Out_Middle']
@@ -108,3 +157,33 @@ class Hypothesis1Analyzer:
         print(f"Mean error behind the ear: {np.mean(behind_ear_errors):.2f}")
         print(f"Mean error in the ear: {np.mean(in_ear_errors):.2f}")
         print(f"T-test p-value for comparing errors: {t_stat_errors}, {p_val_errors}")
+
+    def analyze_fusion(self, phases):
+        # Fused estimates against the plain in-ear and behind-ear means, each participant is predicted by a model
+        # fitted on the other participants so the learned biases cannot match its own ground truth
+        data = FusionData.from_temp_data(self.all_temp_data, phases, with_imu=True)
+        in_ear = np.isin(data.columns, ['TympanicMembrane', 'Concha', 'EarCanal'])
+        estimates = {
+            'In-ear mean': row_means(data.filled[:, in_ear]),
+            'Behind-ear mean': row_means(data.filled[:, ~in_ear]),
+            'WLS': leave_one_participant_out(WeightedLeastSquaresFusion, data),
+            'Ridge': leave_one_participant_out(RidgeFusion, data),
+            'Ridge + IMU': leave_one_participant_out(lambda: RidgeFusion(with_imu=True), data),
+            'Kalman': leave_one_participant_out(KalmanFusion, data),
+        }
+        ground_truth = data.participant_ground_truth()
+        errors = {name: np.abs(data.participant_means(estimate) - ground_truth) for name, estimate in estimates.items()}
+        for name, error in errors.items():
+            # Participants without a cycle in the phases have no error
+            error = error[np.isfinite(error)]
+            print(f"Mean error {name}: {error.mean():.2f}" if len(error) else f"Mean error {name}: no data")
+        return pd.DataFrame(errors, index=data.sources)
+
+    def analyze_sensor_subsets(self, phases, weighting='mean', max_size=None):
+        # Every combination of the six locations instead of the two hard-coded groups of analyze_mean_error,
+        # one (participant, phase) mean per cell
+        statistics = PhaseStatistics.reuse(self.phase_statistics, self.all_temp_data, phases)
+        subset_statistics = SubsetStatistics.from_phase_statistics(statistics, phases)
+        ranking = search_subsets(subset_statistics, statistics.temp_columns, weighting, max_size, self.num_workers)
+        print(ranking[ranking['Pareto']].to_string(index=False))
+        return ranking
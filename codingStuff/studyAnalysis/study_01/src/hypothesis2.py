@@ -1,49 +1,27 @@
 from scipy import stats
 import numpy as np
+from common.src.phase_statistics import PhaseStatistics
 
 
 class Hypothesis2Analyzer:
-    def __init__(self, all_temp_data):
+    def __init__(self, all_temp_data, phase_statistics=None):
         self.all_temp_data = all_temp_data
+        self.phase_statistics = phase_statistics  # PhaseStatistics shared by the analyzers, computed if None
 
     def analyze(self):
         variances_by_sensor = {'Indoor': {}, 'Outdoor': {}}
         diff_from_ground_truth = {'Indoor': {}, 'Outdoor': {}}
         diff_from_mean = {'Indoor': {}, 'Outdoor': {}}
-        num_tests = 0  # Keep track of the number of tests
 
-        for temp_data in self.all_temp_data:
-            indoor_data = temp_data.raw_data[temp_data.raw_data['ID'] == 2]
-            outdoor_data = temp_data.raw_data[temp_data.raw_data['ID'] == 3]
+        statistics = PhaseStatistics.reuse(self.phase_statistics, self.all_temp_data, [2, 3])
+        for phase, phase_id in [('Indoor', 2), ('Outdoor', 3)]:
+            variances = statistics.get('var', phase_id)
+            gt_errors = statistics.get('gt_error', phase_id)
+            for i, sensor in enumerate(statistics.temp_columns):
+                variances_by_sensor[phase][sensor] = list(variances[:, i])
+                diff_from_ground_truth[phase][sensor] = list(gt_errors[:, i])
 
-            ground_truth = temp_data.real_temp_ground_truth
-
-            for sensor in temp_data.temp_columns:
-                indoor_mean = np.mean(indoor_data[sensor])
-                indoor_var = np.var(indoor_data[sensor])
-                outdoor_mean = np.mean(outdoor_data[sensor])
-                outdoor_var = np.var(outdoor_data[sensor])
-
-                indoor_diff_from_gt = indoor_mean - ground_truth
-                outdoor_diff_from_gt = outdoor_mean - ground_truth
-
-                if sensor not in variances_by_sensor['Indoor']:
-                    variances_by_sensor['Indoor'][sensor] = []
-                if sensor not in variances_by_sensor['Outdoor']:
-                    variances_by_sensor['Outdoor'][sensor] = []
-
-                variances_by_sensor['Indoor'][sensor].append(indoor_var)
-                variances_by_sensor['Outdoor'][sensor].append(outdoor_var)
-
-                if sensor not in diff_from_ground_truth['Indoor']:
-                    diff_from_ground_truth['Indoor'][sensor] = []
-                if sensor not in diff_from_ground_truth['Outdoor']:
-                    diff_from_ground_truth['Outdoor'][sensor] = []
-
-                diff_from_ground_truth['Indoor'][sensor].append(indoor_diff_from_gt)
-                diff_from_ground_truth['Outdoor'][sensor].append(outdoor_diff_from_gt)
-
-                num_tests += 1
+        num_tests = len(self.all_temp_data) * len(statistics.temp_columns)
 
         # Calculations and output
         for sensor in self.all_temp_data[0].temp_columns:
@@ -3,17 +3,21 @@
 # different sensor locations.
 import os
 import numpy as np
-from scipy.stats import pearsonr, spearmanr, ttest_rel
+from scipy.stats import ttest_rel
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 from scipy import stats
+from common.src.correlation import correlation_matrix, fisher_z_mean
+from common.src.phase_statistics import PhaseStatistics
 
 
 class Hypothesis3Analyzer:
-    def __init__(self, all_temp_data):
+    def __init__(self, all_temp_data, phase_statistics=None, min_cycles=None):
         self.avg_correlations = {}
         self.all_temp_data = all_temp_data
+        self.phase_statistics = phase_statistics  # PhaseStatistics shared by the analyzers, computed if None
+        self.min_cycles = min_cycles  # fewest dense read cycles of a phase to enter the average, None keeps all
 
     # absolute abweichung anschauen
 
@@ -59,56 +63,60 @@ class Hypothesis3Analyzer:
             plt.savefig(plot_filename, dpi=300, bbox_inches='tight')
             plt.close()
 
-    def analyze(self):
+    def analyze(self, fisher_z=True):
         self.avg_correlations = {}
-
-        for temp_data in self.all_temp_data:
-            for phase_id in [2, 3]:  # Phase 2 (Indoor), Phase 3 (Outdoor)
-                phase_data = temp_data.raw_data[temp_data.raw_data['ID'] == phase_id]
-
-                # Group every 6 rows and aggregate
-                grouped_data = phase_data.groupby(phase_data.index // 6)
-                aggregated_data = grouped_data.agg({
-                    'TIMESTAMP': 'mean',
-                    'ID': 'first',
-                    **{col: 'first' for col in temp_data.temp_columns}
-                }).dropna()
-
-                # Calculate correlations for this participant and phase
-                for sensor1 in temp_data.temp_columns:
-                    for sensor2 in temp_data.temp_columns:
-                        if sensor1 >= sensor2:
-                            continue
-                        corr, _ = spearmanr(aggregated_data[sensor1], aggregated_data[sensor2])
-
-                        key = f"{sensor1}-{sensor2}-Phase{phase_id}"
-                        if key not in self.avg_correlations:
-                            self.avg_correlations[key] = []
-                        self.avg_correlations[key].append(corr)
-
-        # Average the Fisher Z-values across all participants and convert back to correlation
-        for key, values in self.avg_correlations.items():
-            self.avg_correlations[key] = np.mean(values)
+        self.correlation_matrices = {}
+        self.n_cycles = {}  # read cycles behind every participant's matrix
+        temp_columns = self.all_temp_data[0].temp_columns
+
+        for phase_id in [2, 3]:  # Phase 2 (Indoor), Phase 3 (Outdoor)
+            # (participant x sensor x sensor) Spearman correlations, one rank pass per participant
+            matrices = []
+            n_cycles = []
+            for temp_data in self.all_temp_data:
+                # One row per read cycle, cycles with a missing sensor are dropped
+                aggregated_data = temp_data.get_dense_data().phase(phase_id).to_dataframe().dropna()
+                matrices.append(correlation_matrix(aggregated_data[temp_columns].to_numpy(), 'spearman'))
+                n_cycles.append(len(aggregated_data))
+            self.correlation_matrices[phase_id] = np.array(matrices)
+            self.n_cycles[phase_id] = np.array(n_cycles)
+
+        for phase_id, matrices in self.correlation_matrices.items():
+            included = np.ones(len(matrices), dtype=bool)
+            if self.min_cycles is not None:
+                # A correlation of a few cycles is close to +-1 by chance, such participants can be left out
+                included = self.n_cycles[phase_id] >= self.min_cycles
+                for temp_data, n_cycles, kept in zip(self.all_temp_data, self.n_cycles[phase_id], included):
+                    if not kept:
+                        print(f"Hypothesis3: excluded {temp_data.source_filename} from Phase {phase_id}, "
+                              f"only {n_cycles} of {self.min_cycles} read cycles")
+            if not included.any():
+                averaged = np.full(matrices.shape[1:], np.nan)
+            elif fisher_z:
+                # Average the Fisher Z-values across the participants and convert back to correlation
+                averaged = fisher_z_mean(matrices[included])
+            else:
+                averaged = np.mean(matrices[included], axis=0)
+            for i, sensor1 in enumerate(temp_columns):
+                for j, sensor2 in enumerate(temp_columns):
+                    if sensor1 >= sensor2:
+                        continue
+                    self.avg_correlations[f"{sensor1}-{sensor2}-Phase{phase_id}"] = averaged[i, j]
 
         print(f"Average correlations for Phases 2 and 3: {self.avg_correlations}")
 
     def analyze_mad(self):
         mad_by_sensor = {'Indoor': {}, 'Outdoor': {}}
 
-        for temp_data in self.all_temp_data:
-            for phase, phase_id in [('Indoor', 2), ('Outdoor', 3)]:
-                phase_data = temp_data.raw_data[temp_data.raw_data['ID'] == phase_id]
-                if phase_data.empty:
-                    continue
-
-                for sensor in temp_data.temp_columns:
-                    sensor_data = phase_data[sensor].dropna()  # Remove NaNs if any
-                    mad_value = np.mean(np.absolute(sensor_data - np.mean(sensor_data)))  # Compute MAD
-
-                    if sensor not in mad_by_sensor[phase]:
-                        mad_by_sensor[phase][sensor] = []
+        statistics = PhaseStatistics.reuse(self.phase_statistics, self.all_temp_data, [2, 3])
+        for phase, phase_id in [('Indoor', 2), ('Outdoor', 3)]:
+            # Mean absolute deviation of the non-NaN readings, subjects without data in the phase are left out
+            mads = statistics.get('mad', phase_id)[statistics.present(phase_id)]
+            if len(mads) == 0:
+                continue
 
-                    mad_by_sensor[phase][sensor].append(mad_value)
+            for i, sensor in enumerate(statistics.temp_columns):
+                mad_by_sensor[phase][sensor] = list(mads[:, i])
 
         # Compute average MAD for each sensor and phase
         avg_mad_by_sensor = {}
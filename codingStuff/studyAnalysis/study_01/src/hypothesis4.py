@@ -1,41 +1,30 @@
-import numpy as np
 from scipy.stats import ttest_rel
+from common.src.phase_statistics import PhaseStatistics
 
 
 class Hypothesis4Analyzer:
-    def __init__(self, all_temp_data):
+    def __init__(self, all_temp_data, phase_statistics=None):
         self.all_temp_data = all_temp_data
+        self.phase_statistics = phase_statistics  # PhaseStatistics shared by the analyzers, computed if None
 
     def analyze(self):
         stability_metrics = {'Phase2': {}, 'Phase3': {}}
         stability_sums = {'Phase2': {}, 'Phase3': {}}
         p_values = {}
-        subject_count = 0
+        subject_count = len(self.all_temp_data)
 
-        for temp_data in self.all_temp_data:
-            subject_count += 1
-            for phase in [2, 3]:  # Only consider Phases 2 and 3
-                phase_key = f"Phase{phase}"
+        statistics = PhaseStatistics.reuse(self.phase_statistics, self.all_temp_data, [2, 3])
+        for phase in [2, 3]:  # Only consider Phases 2 and 3
+            phase_key = f"Phase{phase}"
 
-                phase_data = temp_data.raw_data[temp_data.raw_data['ID'] == phase]
-                if phase_data.empty:
-                    continue
+            # Subjects without data in a phase are left out, the sums are still averaged over all subjects
+            std_devs = statistics.get('std', phase)[statistics.present(phase)]
+            if len(std_devs) == 0:
+                continue
 
-                for sensor in temp_data.temp_columns:
-                    # Calculate the standard deviation for each sensor's readings
-                    std_dev = np.std(phase_data[sensor])
-
-                    if sensor not in stability_metrics[phase_key]:
-                        stability_metrics[phase_key][sensor] = []
-                        stability_sums[phase_key][sensor] = 0.0
-
-                    stability_metrics[phase_key][sensor].append(std_dev)
-                    stability_sums[phase_key][sensor] += std_dev
-
-        # Average the standard deviations across all subjects
-        for phase_key in stability_sums:
-            for sensor in stability_sums[phase_key]:
-                stability_sums[phase_key][sensor] /= subject_count
+            for i, sensor in enumerate(statistics.temp_columns):
+                stability_metrics[phase_key][sensor] = list(std_devs[:, i])
+                stability_sums[phase_key][sensor] = sum(std_devs[:, i], 0.0) / subject_count
 
         # Perform paired t-tests for each sensor
         for sensor in self.all_temp_data[0].temp_columns:  # Assuming temp_columns is the same for all temp_data
@@ -5,19 +5,24 @@ import os
 from matplotlib.backends.backend_pdf import PdfPages
 import seaborn as sns
 from tqdm import tqdm
+from common.src.time_windows import TimeIndex
 
 
 class Hypothesis5Analyzer:
 
-    def __init__(self, all_temp_data, output_folder):
+    def __init__(self, all_temp_data, output_folder, window=250, resample_interval=None):
         self.all_temp_data = all_temp_data
         self.output_folder = output_folder
+        # A number of rows (250 is 5 s at the nominal 50 Hz) or a time span like '5s'
+        self.window = window
+        # Time span like '1s', puts every subject on the same time grid before the subjects are averaged
+        self.resample_interval = resample_interval
         self.temp_columns = ['TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle']
         self.imu_columns = ['ACC_X', 'ACC_Y', 'ACC_Z', 'GYRO_X', 'GYRO_Y', 'GYRO_Z', 'MAG_X', 'MAG_Y', 'MAG_Z']
         self.yAxisRange = [0, 2.5]
 
-    def filter_phases(self, data):
-        return data[data['ID'].isin([2, 3, 4])].copy()
+    def filter_phases(self, temp_data):
+        return temp_data.get_phase_data([2, 3, 4]).copy()
 
     def adjust_time_to_minutes(self, data, time_column='TIMESTAMP'):
         min_time = data[time_column].min()
@@ -37,6 +42,13 @@ class Hypothesis5Analyzer:
         axes[-1].set_xlabel('Time (minutes)')
         axes[-1].set_ylabel('Mean Movement')
 
+    def calculate_marc(self, sensor_data, sensor):
+        change = sensor_data[sensor].diff().abs()
+        if isinstance(self.window, (int, np.integer)):
+            return change.rolling(window=self.window).mean()
+        time_index = TimeIndex(sensor_data['AdjustedTime'], seconds_per_unit=60.0)
+        return pd.Series(time_index.rolling_mean(change.to_numpy(), self.window), index=change.index)
+
     def aggregate_absolute_relative_change(self, all_subject_data, sensor):
         # Concatenate all subject data into a single DataFrame
         aggregated_data = pd.concat(all_subject_data)
@@ -53,7 +65,7 @@ class Hypothesis5Analyzer:
         aggregated_sensor_data = {sensor: [] for sensor in self.temp_columns}
 
         for temp_data in self.all_temp_data:
-            phase_data = self.filter_phases(temp_data.raw_data)
+            phase_data = self.filter_phases(temp_data)
             phase_data = self.adjust_time_to_minutes(phase_data)
 
             imu_data = self.calculate_mean_movement(phase_data)
@@ -62,8 +74,14 @@ class Hypothesis5Analyzer:
             for sensor in self.temp_columns:
                 temp_data = phase_data[['AdjustedTime', sensor]].dropna()
                 # initial_value = temp_data[sensor].iloc[0]
-                temp_data['AbsoluteRelativeChange'] = temp_data[sensor].diff().abs().rolling(window=250).mean()
-                aggregated_sensor_data[sensor].append(temp_data[['AdjustedTime', 'AbsoluteRelativeChange']])
+                temp_data['AbsoluteRelativeChange'] = self.calculate_marc(temp_data, sensor)
+                marc_data = temp_data[['AdjustedTime', 'AbsoluteRelativeChange']]
+                if self.resample_interval is not None:
+                    time_index = TimeIndex(marc_data['AdjustedTime'], seconds_per_unit=60.0)
+                    marc_data = time_index.resample_frame(marc_data, ['AbsoluteRelativeChange'],
+                                                          self.resample_interval)
+                    marc_data = marc_data.rename(columns={'TIMESTAMP': 'AdjustedTime'}).dropna()
+                aggregated_sensor_data[sensor].append(marc_data)
 
         # Plot aggregated sensor data
         for i, (sensor, all_subject_data) in enumerate(aggregated_sensor_data.items()):
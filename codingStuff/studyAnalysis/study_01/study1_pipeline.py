@@ -1,6 +1,8 @@
 import os
-import numpy as np
-import pandas as pd
+from common.src.binary_log import select_log_files
+from common.src.log_cache import load_earable_log
+from common.src.parallel import map_ordered
+from common.src.phase_statistics import PhaseStatistics
 from study_01.src.TemperatureData import TemperatureData
 from study_01.src.hypothesis1 import Hypothesis1Analyzer
 from study_01.src.hypothesis2 import Hypothesis2Analyzer
@@ -9,10 +11,45 @@ from study_01.src.hypothesis4 import Hypothesis4Analyzer
 from study_01.src.hypothesis5 import Hypothesis5Analyzer
 
 
+def load_temperature_data(file_path, target_path, ground_truth_temps, calibration=None, motion_gating=False):
+    print(f"Processing file: {file_path}")
+    temp_columns = ['TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle']
+
+    # Zeros are replaced with NaN and temperatures scaled to °C by the (cached) loader
+    df = load_earable_log(file_path, temp_columns)
+    if calibration is not None:
+        df = calibration.apply_frame(df, temp_columns)
+
+    # Extract proband number from file name
+    basename = os.path.basename(file_path)
+    proband_number = basename.split('_')[2].split('.')[0]
+
+    # Look up real temperature ground truth based on proband number
+    real_temp_ground_truth = ground_truth_temps.get(proband_number, 100.0)  # Default to 37.0 if not found
+
+    temp_subj_data = TemperatureData(
+        df,
+        temp_columns,
+        os.path.basename(file_path),
+        os.path.dirname(file_path),
+        os.path.dirname(target_path),
+        real_temp_ground_truth,
+        scale_temperatures=False,
+        motion_gating=motion_gating
+    )
+
+    temp_subj_data.smooth_data()
+    # temp_subj_data.plot_raw_data()
+    return temp_subj_data
+
+
 class AnalysisPipeline:
-    def __init__(self, data_dir, target_dir):
+    def __init__(self, data_dir, target_dir, num_workers=1, calibration=None, motion_gating=False):
         self.data_dir = data_dir
         self.target_dir = target_dir
+        self.num_workers = num_workers  # > 1 loads the files in that many processes
+        self.calibration = calibration  # CalibrationModel applied to the temperatures at load time, None keeps them raw
+        self.motion_gating = motion_gating  # True drops the temperatures of samples with motion artifacts
         self.all_temp_data = []
         self.all_imu_data = []
         self.ground_truth_temps = {
@@ -33,75 +70,69 @@ class AnalysisPipeline:
         }
 
     def process_directory(self, dir_path, target_path):
-        for item in os.listdir(dir_path):
+        jobs = [(file_path, file_target_path, self.ground_truth_temps, self.calibration, self.motion_gating)
+                for file_path, file_target_path in self.collect_files(dir_path, target_path)]
+        self.all_temp_data.extend(map_ordered(load_temperature_data, jobs, self.num_workers))
+
+    def collect_files(self, dir_path, target_path):
+        # Same order as the recursive walk, so results do not depend on the number of workers
+        files = []
+        items = os.listdir(dir_path)
+        log_files = set(select_log_files(items))
+        for item in items:
             item_path = os.path.join(dir_path, item)
             item_target_path = os.path.join(target_path, item)
             if os.path.isdir(item_path):
                 os.makedirs(item_target_path, exist_ok=True)
-                self.process_directory(item_path, item_target_path)
-            elif item_path.endswith('.csv'):
-                self.process_file(item_path, item_target_path)
+                files.extend(self.collect_files(item_path, item_target_path))
+            elif item in log_files:
+                files.append((item_path, item_target_path))
+        return files
 
     def process_file(self, file_path, target_path):
-        print(f"Processing file: {file_path}")
-        df = pd.read_csv(file_path)
-
-        # Replace 0 with NaN in temperature columns
-        temp_columns = ['TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle']
-        df[temp_columns] = df[temp_columns].replace(0, np.nan)
-
-        # Extract proband number from file name
-        basename = os.path.basename(file_path)
-        proband_number = basename.split('_')[2].split('.')[0]
-
-        # Look up real temperature ground truth based on proband number
-        real_temp_ground_truth = self.ground_truth_temps.get(proband_number, 100.0)  # Default to 37.0 if not found
-
-        temp_subj_data = TemperatureData(
-            df,
-            temp_columns,
-            os.path.basename(file_path),
-            os.path.dirname(file_path),
-            os.path.dirname(target_path),
-            real_temp_ground_truth
-        )
-
-        temp_subj_data.smooth_data()
-        # temp_subj_data.plot_raw_data()
-        self.all_temp_data.append(temp_subj_data)
-
+        self.all_temp_data.append(load_temperature_data(file_path, target_path, self.ground_truth_temps,
+                                                        self.calibration, self.motion_gating))
 
 
 if __name__ == '__main__':
     data_dir = 'data/study_data'
     target_dir = 'target'
 
-    pipeline = AnalysisPipeline(data_dir, target_dir)
+    pipeline = AnalysisPipeline(data_dir, target_dir, num_workers=os.cpu_count())
     pipeline.process_directory(data_dir, target_dir)
+    # Per participant, phase and sensor statistics shared by all analyzers
+    phase_statistics = PhaseStatistics(pipeline.all_temp_data, [2, 3, 4])
 
     print("Analyzing hypothesis 1")
     print('')
-    hypothesis1 = Hypothesis1Analyzer(pipeline.all_temp_data)
+    hypothesis1 = Hypothesis1Analyzer(pipeline.all_temp_data, phase_statistics=phase_statistics)
     print("Mean and error of only sitting phase")
     hypothesis1.analyze_mean_error([2])
     print('')
     print("Mean and error of phases 2,3,4")
     hypothesis1.analyze_mean_error([2, 3, 4])
     print('')
+    print("Fused estimates of phases 2,3,4")
+    hypothesis1.analyze_fusion([2, 3, 4])
+    print('')
+    print("Best sensor subsets of phases 2,3,4 (plain mean, bias-corrected BLUE)")
+    hypothesis1.analyze_sensor_subsets([2, 3, 4])
+    hypothesis1.analyze_sensor_subsets([2, 3, 4], weighting='blue')
+    print('')
     hypothesis1.boxplot()
 
     print("Analyzing hypothesis 2")
-    hypothesis2 = Hypothesis2Analyzer(pipeline.all_temp_data)
+    hypothesis2 = Hypothesis2Analyzer(pipeline.all_temp_data, phase_statistics)
     hypothesis2.analyze()
 
     print("Analyzing hypothesis 3")
-    hypothesis3 = Hypothesis3Analyzer(pipeline.all_temp_data)
+    hypothesis3 = Hypothesis3Analyzer(pipeline.all_temp_data, phase_statistics)
     hypothesis3.analyze()
     hypothesis3.analyze_mad()
     hypothesis3.generate_heatmap()
 
     print("Analyzing hypothesis 4")
-    hypothesis4 = Hypothesis4Analyzer(pipeline.all_temp_data)
+    hypothesis4 = Hypothesis4Analyzer(pipeline.all_temp_data, phase_statistics)
     hypothesis4.analyze()
 
     print("Analyzing hypothesis 5")
@@ -1,7 +1,9 @@
 import numpy as np
 import pandas as pd
 import heartpy as hp
-from scipy.fft import fft
+from study_02.src.hrv_features import sliding_hrv_features
+from study_02.src.hrv_indices import phase_autonomic_indices
+from study_02.src.hrv_spectrum import HRVSpectrum
 
 
 class HRVData:
@@ -11,6 +13,9 @@ class HRVData:
         self.hrv_timestamps = hrv_timestamps
         self.hrv_filepath = hrv_file_path
         self.hrv_filename = hrv_file_name
+        # Time in ms at the end of every beat, so time lookups are a binary search instead of summing up RR-intervals
+        self.beat_times = np.cumsum(self.hrv_df['RRIntervals'].to_numpy())
+        self.spectrum = None
         self.kubios_data = {
             'p01': {
                 'sitting': {
@@ -159,22 +164,23 @@ class HRVData:
             }
         }
 
-    def time_to_index(self, time_str):
-        """Converts time in 'minutes:seconds' format to index"""
+    @staticmethod
+    def time_to_ms(time_str):
         mins, secs = map(int, time_str.split(':'))
         total_secs = mins * 60 + secs
-        total_ms = total_secs * 1000  # Convert to milliseconds
-
-        # Sum up RR-intervals until total_ms is reached or exceeded
-        rr_intervals = self.hrv_df['RRIntervals'].values
-        elapsed_ms = 0
-        index = 0
-        for i, rr in enumerate(rr_intervals):
-            elapsed_ms += rr
-            if elapsed_ms >= total_ms:
-                index = i
-                break
-        return index
+        return total_secs * 1000  # Convert to milliseconds
+
+    def time_to_index(self, time_str):
+        """Converts time in 'minutes:seconds' format to index"""
+        return int(self.times_to_indices(self.time_to_ms(time_str)))
+
+    def times_to_indices(self, times_ms):
+        """
+        Index of the first beat at which the summed up RR-intervals reach or exceed each time in ms, 0 for times
+        after the last beat. Takes a single time or an array of times.
+        """
+        indices = np.searchsorted(self.beat_times, times_ms, side='left')
+        return np.where(indices < len(self.beat_times), indices, 0)
 
     def print_statistics(self):
         proband_number = self.hrv_filepath.split('/')[2]
@@ -208,43 +214,56 @@ class HRVData:
         start_idx = self.time_to_index(self.hrv_timestamps[phase_start])
         end_idx = self.time_to_index(self.hrv_timestamps[phase_end])
 
+        # An empty window is NaN, also for end_idx 0 (a time after the last beat), where beat_times[end_idx - 1]
+        # would wrap around to the last beat
         if start_idx >= end_idx or start_idx < 0 or end_idx > len(self.hrv_df['RRIntervals']):
             print(f"Invalid indices for {phase_start} to {phase_end}")
-            return
+            return np.nan, np.nan, np.nan
 
         rr_intervals = self.hrv_df['RRIntervals'].values[start_idx:end_idx]
 
         if len(rr_intervals) == 0:
             print(f"No RR intervals found for {phase_start} to {phase_end}")
-            return
+            return np.nan, np.nan, np.nan
 
         # Time-domain features
         sdnn = np.std(rr_intervals)
         rmssd = np.sqrt(np.mean(np.square(np.diff(rr_intervals))))
 
-        # Frequency-domain feature
-        lf_hf_ratio = self.calculate_lf_hf(rr_intervals)  # Assuming you've implemented this function
+        # Frequency-domain feature, from the spectrum of the whole session resampled once
+        lf_hf_ratio = self.get_spectrum().lf_hf(self.beat_times[start_idx], self.beat_times[end_idx - 1])
 
         return sdnn, rmssd, lf_hf_ratio
 
 
-    def calculate_lf_hf(self, rr_intervals):
-        # Calculate FFT
-        freq = np.fft.fftfreq(len(rr_intervals))
-        fft_values = fft(rr_intervals)
+    def get_phase_rr(self, phase_start, phase_end=None):
+        """RR-intervals between two keys of hrv_timestamps, phase_end None runs to the end of the recording"""
+        rr_intervals = self.hrv_df['RRIntervals'].to_numpy()
+        start_idx = self.time_to_index(self.hrv_timestamps[phase_start])
+        end_idx = len(rr_intervals) if phase_end is None else self.time_to_index(self.hrv_timestamps[phase_end])
+        return rr_intervals[start_idx:end_idx]
 
-        # Calculate power spectral density
-        psd = np.abs(fft_values) ** 2
+    def get_autonomic_indices(self, phases=None, parameters=None):
+        """
+        Stress index, SD1/SD2 and mean RR/HR per phase computed like Kubios does, and a fitted approximation of its
+        PNS and SNS index, see hrv_indices.PNS_NORMS
+        """
+        return phase_autonomic_indices([self], phases, parameters=parameters)
 
-        # Get LF and HF band limits in terms of array indices
-        lf_band = (freq >= 0.04) & (freq <= 0.15)
-        hf_band = (freq >= 0.15) & (freq <= 0.4)
+    def get_spectrum(self):
+        if self.spectrum is None:
+            self.spectrum = HRVSpectrum(self.hrv_df['RRIntervals'].to_numpy())
+        return self.spectrum
 
-        # Calculate power in LF and HF bands
-        lf_power = np.sum(psd[lf_band])
-        hf_power = np.sum(psd[hf_band])
+    def get_band_powers(self, starts_ms, ends_ms):
+        """LF, HF, total power and LF/HF for many windows of the session at once"""
+        return self.get_spectrum().band_powers(starts_ms, ends_ms)
 
-        # Calculate LF/HF ratio
-        lf_hf_ratio = lf_power / hf_power
+    def get_sliding_features(self, window_seconds=300.0, step_seconds=30.0):
+        """Time indexed HRV features over the whole session, see sliding_hrv_features"""
+        return sliding_hrv_features(self.hrv_df['RRIntervals'].to_numpy(), window_seconds, step_seconds,
+                                    self.get_spectrum())
 
-        return lf_hf_ratio
\ No newline at end of file
+    def calculate_lf_hf(self, rr_intervals):
+        # Bands in Hz on the beat-time axis (4 Hz cubic resampling and Welch), not in cycles per beat
+        return HRVSpectrum(rr_intervals).lf_hf()
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+from study_02.src.hrv_spectrum import HRVSpectrum
+
+FEATURE_COLUMNS = ['n_beats', 'Mean_RR', 'Mean_HR', 'SDNN', 'RMSSD', 'pNN50', 'LF', 'HF', 'LF_HF']
+
+
+def window_sums(prefix, first, last):
+    return prefix[last] - prefix[first]
+
+
+def sliding_hrv_features(rr_intervals, window_seconds=300.0, step_seconds=30.0, spectrum=None):
+    """
+    HRV features of windows of window_seconds every step_seconds over a whole session. The time-domain features
+    come from prefix sums over the beats, so every window costs O(1) after one pass, LF/HF comes from one batched
+    spectrum call. SDNN is the population standard deviation like np.std in HRVData.get_statistics. TIMESTAMP is
+    the end of each window in minutes since the first beat of the recording started.
+    """
+    rr_intervals = np.asarray(rr_intervals, dtype=np.float64)
+    beat_times = np.cumsum(rr_intervals)
+    window_ms = window_seconds * 1000.0
+    if len(beat_times) == 0 or beat_times[-1] < window_ms:
+        # Typed empty columns, an object TIMESTAMP column would fail merge_asof in join_hrv_features
+        return pd.DataFrame({column: np.empty(0, dtype=np.int64 if column == 'n_beats' else np.float64)
+                             for column in ['TIMESTAMP', 'start_ms', 'end_ms'] + FEATURE_COLUMNS})
+
+    starts = np.arange(0.0, beat_times[-1] - window_ms + 1, step_seconds * 1000.0)
+    ends = starts + window_ms
+    first = np.searchsorted(beat_times, starts, side='left')
+    last = np.searchsorted(beat_times, ends, side='left')  # beats first..last-1 end inside the window
+    n_beats = last - first
+
+    # Shifting by the session mean keeps the sum of squares well conditioned
+    shifted = rr_intervals - rr_intervals.mean()
+    sum_rr = window_sums(np.concatenate(([0.0], np.cumsum(shifted))), first, last)
+    sum_rr2 = window_sums(np.concatenate(([0.0], np.cumsum(shifted ** 2))), first, last)
+
+    # Successive differences between beats j and j + 1, both inside the window
+    differences = np.diff(rr_intervals)
+    sum_diff2 = window_sums(np.concatenate(([0.0], np.cumsum(differences ** 2))), first, np.maximum(last - 1, first))
+    n_nn50 = window_sums(np.concatenate(([0], np.cumsum(np.abs(differences) > 50))), first, np.maximum(last - 1, first))
+    n_differences = np.maximum(n_beats - 1, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_shifted = sum_rr / n_beats
+        mean_rr = mean_shifted + rr_intervals.mean()
+        sdnn = np.sqrt(np.maximum(sum_rr2 / n_beats - mean_shifted ** 2, 0))
+        rmssd = np.sqrt(sum_diff2 / n_differences)
+        pnn50 = 100.0 * n_nn50 / n_differences
+
+    if spectrum is None:
+        spectrum = HRVSpectrum(rr_intervals)
+    powers = spectrum.band_powers(starts, ends)
+
+    return pd.DataFrame({
+        'TIMESTAMP': ends / 1000.0 / 60.0,
+        'start_ms': starts,
+        'end_ms': ends,
+        'n_beats': n_beats,
+        'Mean_RR': mean_rr,
+        'Mean_HR': 60000.0 / mean_rr,
+        'SDNN': sdnn,
+        'RMSSD': rmssd,
+        'pNN50': pnn50,
+        'LF': powers['lf'],
+        'HF': powers['hf'],
+        'LF_HF': powers['lf_hf'],
+    })
+
+
+def join_hrv_features(temperature_df, features, offset_minutes=0.0, tolerance_minutes=None):
+    """
+    Gives every temperature row the features of the last HRV window which ended at or before it. offset_minutes
+    is the start of the HRV recording on the temperature time axis (TIMESTAMP in minutes).
+    """
+    features = features.drop(columns=['start_ms', 'end_ms']).copy()
+    features['TIMESTAMP'] = features['TIMESTAMP'] + offset_minutes
+    return pd.merge_asof(temperature_df.sort_values('TIMESTAMP'), features.sort_values('TIMESTAMP'),
+                         on='TIMESTAMP', direction='backward', tolerance=tolerance_minutes)
@@ -0,0 +1,226 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+# The analysis samples of the Kubios exports stored in HRVData.kubios_data, None runs to the end of the recording
+KUBIOS_PHASES = {
+    'sitting': ('start_sitting', 'stroop_start'),
+    'stress': ('stroop_start', 'stress_end'),
+    'relax': ('stress_end', None),
+}
+
+# Smoothness priors detrending on the beat index and the (mean, standard deviation) behind the z-scores of the PNS
+# and SNS index. These are not the published population norms Kubios uses, so the PNS and SNS index computed here are
+# a fitted approximation of the Kubios values: fit_kubios_parameters fits them to the stored exports, these values on
+# all 15 cells. They are only used for participants without an export, held_out_kubios_parameters gives every other
+# participant constants fitted without its own cells.
+DETREND_LAMBDA = 50.0
+DETREND_LAMBDAS = (10.0, 20.0, 50.0, 100.0, 200.0, 500.0)
+HISTOGRAM_BIN_MS = 50.0
+PNS_NORMS = {'Mean_RR': (926.0, 73.0), 'RMSSD': (42.0, 13.0), 'SD1_in_percent': (31.0, 18.0)}
+SNS_NORMS = {'Mean_HR': (66.0, 5.7), 'Stress_Index': (10.0, 2.0), 'SD2_in_percent': (55.0, 21.0)}
+
+INDEX_COLUMNS = ['n_beats', 'Mean_RR', 'Mean_HR', 'RMSSD', 'SD1', 'SD2', 'SD1_in_percent', 'SD2_in_percent',
+                 'Stress_Index', 'PNS_Index', 'SNS_Index']
+KUBIOS_COLUMNS = ['Mean_RR', 'Mean_HR', 'SD1_in_percent', 'SD2_in_percent', 'Stress_Index', 'PNS_Index',
+                  'SNS_Index']
+
+
+def detrend_segments(values, segment_of_row, detrend_lambda=DETREND_LAMBDA):
+    """
+    Smoothness priors detrending of every segment of the packed series. Second differences which cross a segment
+    border are dropped, so one sparse solve detrends all segments independently. The residual of every segment
+    has zero mean.
+    """
+    n = len(values)
+    if n < 3:
+        return values - values.mean() if n else values
+    differences = sparse.diags([1.0, -2.0, 1.0], [0, 1, 2], shape=(n - 2, n), format='csr')
+    differences = differences[segment_of_row[:-2] == segment_of_row[2:]]
+    system = sparse.identity(n, format='csc') + detrend_lambda ** 2 * (differences.T @ differences).tocsc()
+    return values - spsolve(system, values)
+
+
+def z_score_mean(columns, norms):
+    return sum((columns[name] - mean) / std for name, (mean, std) in norms.items()) / len(norms)
+
+
+def with_index_norms(table, pns_norms=PNS_NORMS, sns_norms=SNS_NORMS):
+    table['PNS_Index'] = z_score_mean(table, pns_norms)
+    table['SNS_Index'] = z_score_mean(table, sns_norms)
+    return table
+
+
+def autonomic_indices(segments, detrend_lambda=DETREND_LAMBDA):
+    """
+    Kubios-style autonomic indices of every RR-interval segment (ms), one row per segment. Mean RR and HR come
+    from the raw intervals, everything else from the detrended series. SD1 and SD2 are the Poincaré axes, the
+    stress index is the square root of Baevsky's AMo / (2 Mo MxDMn) on a 50 ms histogram, and PNS and SNS index
+    average z-scores like Kubios does. All segments are packed into one array and reduced with np.bincount, so the
+    cost does not depend on the number of participants and phases.
+    """
+    segments = [np.asarray(segment, dtype=np.float64) for segment in segments]
+    n_segments = len(segments)
+    lengths = np.array([len(segment) for segment in segments], dtype=np.int64)
+    values = np.concatenate(segments) if segments else np.empty(0)
+    segment_of_row = np.repeat(np.arange(n_segments), lengths)
+
+    def sums(weights, rows=segment_of_row):
+        return np.bincount(rows, weights, minlength=n_segments)
+
+    residuals = detrend_segments(values, segment_of_row, detrend_lambda)
+    same_segment = segment_of_row[:-1] == segment_of_row[1:]
+    differences = np.diff(residuals)[same_segment]
+    segment_of_difference = segment_of_row[:-1][same_segment]
+    n_differences = lengths - 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_rr = sums(values) / lengths
+        sdnn = np.sqrt(sums(residuals ** 2) / (lengths - 1))
+        sum_differences = sums(differences, segment_of_difference)
+        sum_differences2 = sums(differences ** 2, segment_of_difference)
+        rmssd = np.sqrt(sum_differences2 / n_differences)
+        sd1 = np.sqrt((sum_differences2 - sum_differences ** 2 / n_differences) / (n_differences - 1) / 2)
+        sd2 = np.sqrt(np.maximum(2 * sdnn ** 2 - sd1 ** 2, 0))
+
+    stress_index = np.full(n_segments, np.nan)
+    if len(values):
+        detrended = residuals + mean_rr[segment_of_row]
+        bins = np.floor(detrended / HISTOGRAM_BIN_MS).astype(np.int64)
+        cells, counts = np.unique(np.column_stack((segment_of_row, bins)), axis=0, return_counts=True)
+        # Highest bin count first, the lowest of tied bins wins like np.argmax on a histogram
+        order = np.lexsort((cells[:, 1], -counts, cells[:, 0]))
+        mode_segments, first = np.unique(cells[order, 0], return_index=True)
+        mode = (cells[order[first], 1] + 0.5) * HISTOGRAM_BIN_MS / 1000.0
+        amplitude = 100.0 * counts[order[first]] / lengths[mode_segments]
+
+        maxima = np.full(n_segments, -np.inf)
+        minima = np.full(n_segments, np.inf)
+        np.maximum.at(maxima, segment_of_row, detrended)
+        np.minimum.at(minima, segment_of_row, detrended)
+        variation_range = (maxima - minima)[mode_segments] / 1000.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stress_index[mode_segments] = np.sqrt(amplitude / (2 * mode * variation_range))
+
+    table = pd.DataFrame({
+        'n_beats': lengths,
+        'Mean_RR': mean_rr,
+        'Mean_HR': 60000.0 / mean_rr,
+        'RMSSD': rmssd,
+        'SD1': sd1,
+        'SD2': sd2,
+        'SD1_in_percent': 100.0 * sd1 / (sd1 + sd2),
+        'SD2_in_percent': 100.0 * sd2 / (sd1 + sd2),
+        'Stress_Index': stress_index,
+    })
+    return with_index_norms(table)
+
+
+def phase_autonomic_indices(all_hrv_data, phases=None, detrend_lambda=DETREND_LAMBDA, parameters=None):
+    """
+    Autonomic indices of every participant and phase in one batch. phases maps a name to a pair of keys of
+    hrv_timestamps, by default the Kubios analysis samples. parameters maps a proband to its own (detrend lambda,
+    PNS norms, SNS norms), e.g. from held_out_kubios_parameters; probands missing from it use detrend_lambda and the
+    default norms.
+    """
+    phases = KUBIOS_PHASES if phases is None else phases
+    parameters = {} if parameters is None else parameters
+    default = (detrend_lambda, PNS_NORMS, SNS_NORMS)
+    lambdas = [parameters.get(hrv_data.proband, default)[0] for hrv_data in all_hrv_data]
+
+    # One batch per detrending lambda, the norms are applied per proband afterwards
+    tables = []
+    for batch_lambda in dict.fromkeys(lambdas) or [detrend_lambda]:
+        batch = [hrv_data for hrv_data, own_lambda in zip(all_hrv_data, lambdas) if own_lambda == batch_lambda]
+        keys = [(hrv_data.proband, phase) for hrv_data in batch for phase in phases]
+        segments = [hrv_data.get_phase_rr(*phases[phase]) for hrv_data in batch for phase in phases]
+        table = autonomic_indices(segments, batch_lambda)
+        table.insert(0, 'Phase', [phase for _, phase in keys])
+        table.insert(0, 'Proband', [proband for proband, _ in keys])
+        for proband in parameters.keys() & set(table['Proband']):
+            rows = table['Proband'] == proband
+            table.loc[rows] = with_index_norms(table[rows].copy(), *parameters[proband][1:])
+        tables.append(table)
+
+    order = {hrv_data.proband: position for position, hrv_data in enumerate(all_hrv_data)}
+    table = pd.concat(tables, ignore_index=True)
+    return table.sort_values('Proband', key=lambda probands: probands.map(order), kind='stable', ignore_index=True)
+
+
+def kubios_table(kubios_data):
+    return pd.DataFrame([dict(Proband=proband, Phase=phase, **values)
+                         for proband, phases in kubios_data.items() for phase, values in phases.items()])
+
+
+def fit_norms(joined, norms, target):
+    """
+    Norms whose z-score mean reproduces the stored target index best in the least squares sense. The index is
+    linear in the parameters, so this is one linear regression. Only the combined offset of the means can be
+    identified, the means of all but the first parameter are therefore kept from norms.
+    """
+    names = list(norms)
+    design = np.column_stack((joined[names].to_numpy(dtype=np.float64), np.ones(len(joined))))
+    coefficients = np.linalg.lstsq(design, joined[target].to_numpy(dtype=np.float64), rcond=None)[0]
+    slopes, intercept = coefficients[:-1], coefficients[-1]
+    means = [norms[name][0] for name in names]
+    means[0] = -(intercept + np.dot(means[1:], slopes[1:])) / slopes[0]
+    return {name: (float(mean), float(1.0 / (len(names) * slope))) for name, mean, slope in zip(names, means, slopes)}
+
+
+def fit_kubios_parameters(candidates, stored, probands=None):
+    """
+    Detrending lambda and PNS and SNS norms fitted to the stored Kubios values of the probands (all by default).
+    candidates maps each lambda to its phase_autonomic_indices. The lambda is chosen by the error of SD1 % and the
+    stress index, each relative to its spread in the exports, the norms are fitted with that lambda.
+    """
+    if probands is not None:
+        stored = stored[stored['Proband'].isin(probands)]
+    errors = {}
+    for detrend_lambda, indices in candidates.items():
+        joined = indices.merge(stored, on=['Proband', 'Phase'], suffixes=('', '_kubios'))
+        errors[detrend_lambda] = sum(
+            (joined[column] - joined[column + '_kubios']).abs().mean() / joined[column + '_kubios'].std()
+            for column in ('SD1_in_percent', 'Stress_Index'))
+    detrend_lambda = min(errors, key=errors.get)
+    joined = candidates[detrend_lambda].merge(stored, on=['Proband', 'Phase'], suffixes=('', '_kubios'))
+    return (detrend_lambda, fit_norms(joined, PNS_NORMS, 'PNS_Index_kubios'),
+            fit_norms(joined, SNS_NORMS, 'SNS_Index_kubios'))
+
+
+def held_out_kubios_parameters(all_hrv_data, kubios_data, detrend_lambdas=DETREND_LAMBDAS):
+    """
+    Leave-one-participant-out parameters: for every proband with a Kubios export the (detrend lambda, PNS norms,
+    SNS norms) fitted on the other participants' exports only.
+    """
+    candidates = {detrend_lambda: phase_autonomic_indices(all_hrv_data, detrend_lambda=detrend_lambda)
+                  for detrend_lambda in detrend_lambdas}
+    stored = kubios_table(kubios_data)
+    probands = stored['Proband'].unique()
+    return {proband: fit_kubios_parameters(candidates, stored, [other for other in probands if other != proband])
+            for proband in probands}
+
+
+def cross_validate_kubios(all_hrv_data, kubios_data, detrend_lambdas=DETREND_LAMBDAS, parameters=None):
+    """
+    Every participant's Kubios cells computed with the parameters of held_out_kubios_parameters, so
+    compare_with_kubios of the result is agreement on held-out cells instead of on the cells the constants were
+    fitted to. parameters already fitted by held_out_kubios_parameters are used as they are.
+    """
+    if parameters is None:
+        parameters = held_out_kubios_parameters(all_hrv_data, kubios_data, detrend_lambdas)
+    with_export = [hrv_data for hrv_data in all_hrv_data if hrv_data.proband in parameters]
+    held_out = phase_autonomic_indices(with_export, parameters=parameters)
+    held_out['Detrend_Lambda'] = held_out['Proband'].map(lambda proband: parameters[proband][0])
+    return held_out
+
+
+def compare_with_kubios(indices, kubios_data):
+    """Mean and maximum absolute difference of every index to the stored Kubios values of the same cells"""
+    joined = indices.merge(kubios_table(kubios_data), on=['Proband', 'Phase'], suffixes=('', '_kubios'))
+    errors = {column: (joined[column] - joined[column + '_kubios']).abs() for column in KUBIOS_COLUMNS}
+    return pd.DataFrame({
+        'n': [len(joined)] * len(errors),
+        'mean_abs_error': [error.mean() for error in errors.values()],
+        'max_abs_error': [error.max() for error in errors.values()],
+    }, index=pd.Index(list(errors), name='Index'))
@@ -4,6 +4,8 @@ import seaborn as snsc
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
+from study_02.src.hrv_indices import (phase_autonomic_indices, compare_with_kubios, cross_validate_kubios,
+                                      held_out_kubios_parameters)
 
 
 class HRVPipeline:
@@ -12,6 +14,7 @@ class HRVPipeline:
         self.sdnn_list = []
         self.rmssd_list = []
         self.lf_hf_list = []
+        self.kubios_parameters = None
 
     def analyze(self):
         # For all 3 phases together
@@ -26,9 +29,25 @@ class HRVPipeline:
         self.get_statistics_for_phase('n-back_start', 'math_start')  # N-back test
         self.get_statistics_for_phase('math_start', 'stress_end')  # Math test
 
+        self.validate_indices()
         self.plot_statistics()
         self.plot_statistics(['p01', 'p04', 'p05'])
 
+    def validate_indices(self):
+        # The constants are fitted to the exports, only the held-out comparison says how well they carry over
+        kubios_data = self.all_hrv_data[0].kubios_data
+        held_out = cross_validate_kubios(self.all_hrv_data, kubios_data, parameters=self.get_kubios_parameters())
+        print('Autonomic indices compared with the Kubios exports, parameters fitted on the other participants '
+              '(PNS and SNS index are a fitted approximation, not the Kubios norms):')
+        print(compare_with_kubios(held_out, kubios_data))
+        return held_out
+
+    def get_kubios_parameters(self):
+        # Every participant's PNS and SNS index uses constants fitted without its own Kubios export
+        if self.kubios_parameters is None:
+            self.kubios_parameters = held_out_kubios_parameters(self.all_hrv_data, self.all_hrv_data[0].kubios_data)
+        return self.kubios_parameters
+
     def get_statistics_for_phase(self, phase_start, phase_end):
         for hrv_data in self.all_hrv_data:
             sdnn, rmssd, lf_hf = hrv_data.get_statistics(phase_start, phase_end)
@@ -47,9 +66,6 @@ class HRVPipeline:
         sdnn_list = []
         rmssd_list = []
         lf_hf_list = []
-        pns_index_list = []
-        sns_index_list = []
-        stress_index_list = []
 
         for hrv_data in self.all_hrv_data:
             if hrv_data.proband not in probands:
@@ -59,24 +75,14 @@ class HRVPipeline:
             rmssd_list.append(rmssd)
             lf_hf_list.append(lf_hf)
 
-        phase = ''
-        if phase_start == 'start_sitting':
-            phase = 'sitting'
-        else:
-            phase = 'stress'
-
-        for kubios_data in self.all_hrv_data[0].kubios_data.values():
-            pns_index_list.append(kubios_data[phase]['PNS_Index'])
-            sns_index_list.append(kubios_data[phase]['SNS_Index'])
-            stress_index_list.append(kubios_data[phase]['Stress_Index'])
-            # 'PNS_Index': -1.6,
-            # 'SD1_in_percent': 23,
-            # 'Mean_RR': 673,
-            # 'SNS_Index': 1.31,
-            # 'SD2_in_percent': 77,
-            # 'Stress_Index': 7,
-            # 'Mean_HR': 89
-
+        # Computed from the RR-intervals instead of read from the Kubios exports, so new participants need no export.
+        # PNS and SNS index are a fitted approximation of the Kubios values with held-out constants
+        selected = [hrv_data for hrv_data in self.all_hrv_data if hrv_data.proband in probands]
+        indices = phase_autonomic_indices(selected, {'phase': (phase_start, phase_end)},
+                                          parameters=self.get_kubios_parameters())
+        pns_index_list = indices['PNS_Index'].tolist()
+        sns_index_list = indices['SNS_Index'].tolist()
+        stress_index_list = indices['Stress_Index'].tolist()
 
         return sdnn_list, rmssd_list, lf_hf_list, pns_index_list, sns_index_list, stress_index_list
 
@@ -140,12 +146,12 @@ class HRVPipeline:
 
         # Second row: PNS_Index, SNS_Index, Stress_Index
         snsc.boxplot(data=df_extended, x='Phase', y='PNS_Index', ax=axes[3])
-        axes[3].set_title('PNS Index', fontsize=14)
+        axes[3].set_title('PNS Index (fitted)', fontsize=14)
         axes[3].set_xlabel('')
         axes[3].set_ylabel('PNS Index', fontsize=14)
 
         snsc.boxplot(data=df_extended, x='Phase', y='SNS_Index', ax=axes[4])
-        axes[4].set_title('SNS Index', fontsize=14)
+        axes[4].set_title('SNS Index (fitted)', fontsize=14)
         axes[4].set_xlabel('')
         axes[4].set_ylabel('SNS Index', fontsize=14)
 
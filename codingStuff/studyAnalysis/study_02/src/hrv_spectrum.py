@@ -0,0 +1,65 @@
+import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.signal import welch
+
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.4)
+TOTAL_BAND = (0.0, 0.4)
+
+
+class HRVSpectrum:
+    """
+    Frequency-domain HRV on the beat-time axis. The RR-interval series is resampled once to an evenly spaced grid
+    of rate Hz with a cubic spline through the beat times, windows of that grid are then Welch-transformed. Windows
+    of equal length are transformed in one batched call, so sliding windows over a session cost about one pass.
+    Powers are in ms².
+    """
+
+    def __init__(self, rr_intervals, rate=4.0, segment_seconds=64.0):
+        rr_intervals = np.asarray(rr_intervals, dtype=np.float64)
+        self.rate = rate
+        self.segment_length = int(segment_seconds * rate)
+        self.beat_times = np.cumsum(rr_intervals)  # ms at the end of every beat
+
+        if len(rr_intervals) < 4:
+            self.grid = np.empty(0)
+            self.values = np.empty(0)
+            return
+        self.grid = np.arange(self.beat_times[0], self.beat_times[-1], 1000.0 / rate)
+        self.values = CubicSpline(self.beat_times, rr_intervals)(self.grid)
+
+    def band_powers(self, starts_ms, ends_ms):
+        """LF, HF and total power and LF/HF of every window [start, end) in ms, as a dict of arrays"""
+        starts_ms = np.atleast_1d(np.asarray(starts_ms, dtype=np.float64))
+        ends_ms = np.atleast_1d(np.asarray(ends_ms, dtype=np.float64))
+        first = np.searchsorted(self.grid, starts_ms, side='left')
+        lengths = np.searchsorted(self.grid, ends_ms, side='left') - first
+
+        powers = {band: np.full(len(first), np.nan) for band in ('lf', 'hf', 'total')}
+        for length in np.unique(lengths):
+            if length < 8:  # too short for a meaningful spectrum
+                continue
+            windows = np.flatnonzero(lengths == length)
+            segments = self.values[first[windows, None] + np.arange(length)]
+            frequencies, psd = welch(segments, fs=self.rate, nperseg=min(self.segment_length, length),
+                                     detrend='linear', axis=-1)
+            df = frequencies[1] - frequencies[0]
+            for band, (low, high) in (('lf', LF_BAND), ('hf', HF_BAND), ('total', TOTAL_BAND)):
+                in_band = (frequencies >= low) & (frequencies < high)
+                powers[band][windows] = psd[:, in_band].sum(axis=-1) * df
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            powers['lf_hf'] = powers['lf'] / powers['hf']
+        return powers
+
+    def sliding_band_powers(self, window_ms, step_ms):
+        """Band powers of windows of window_ms every step_ms over the whole session, plus the window starts"""
+        if len(self.grid) == 0:
+            return np.empty(0), self.band_powers([], [])
+        starts = np.arange(self.grid[0], self.grid[-1] - window_ms + 1, step_ms)
+        return starts, self.band_powers(starts, starts + window_ms)
+
+    def lf_hf(self, start_ms=None, end_ms=None):
+        start_ms = -np.inf if start_ms is None else start_ms
+        end_ms = np.inf if end_ms is None else end_ms
+        return self.band_powers(start_ms, end_ms)['lf_hf'][0]
@@ -19,8 +19,7 @@ class Hypothesis1Analyzer:
             ground_truth = temp_data.ground_truth_temp  # Extract ground truth for the current proband
 
             for phase_id in [2, 3, 4]:  # Loop through the phase IDs (sitting, stress, relax)
-                phase_data = temp_data.raw_data[
-                    temp_data.raw_data['ID'] == phase_id]  # Filter data for the current phase
+                phase_data = temp_data.get_phase_data(phase_id)  # Filter data for the current phase
 
                 for sensor in temp_data.temp_columns:  # Loop through each sensor
                     mean_temp = phase_data[sensor].mean()  # Calculate mean temperature for the current sensor and phase
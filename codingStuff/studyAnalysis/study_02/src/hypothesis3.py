@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.stats import pearsonr
+from study_02.src.hrv_features import join_hrv_features
 
 class Hypothesis3Analyzer:
     def __init__(self, all_temp_data, all_hrv_data, target_dir):
@@ -21,10 +22,10 @@ class Hypothesis3Analyzer:
         # Loop through each participant's temperature and HRV data
         for idx, (temp_data, hrv_data) in enumerate(zip(self.all_temp_data, self.all_hrv_data)):
             # Filter data for phase 3
-            phase3_data = temp_data.raw_data[temp_data.raw_data['ID'] == 3]
+            phase3_data = temp_data.get_phase_data(3)
 
             # Generate timestamps for HRV data, assuming it starts at the same time as the temperature data
-            hrv_timestamps = np.cumsum(hrv_data.hrv_df['RRIntervals']) / 1000  # Convert from ms to s
+            hrv_timestamps = hrv_data.beat_times / 1000  # Convert from ms to s
             hrv_timestamps = phase3_data['TIMESTAMP'].iloc[0] + hrv_timestamps  # Align with temperature data
 
             # Resample temperature data to align with HRV data
@@ -63,4 +64,26 @@ class Hypothesis3Analyzer:
         plt.title('Correlation Between HRV and Ear Temperature')
         plt.legend()
         plt.savefig(os.path.join(self.target_dir, 'hypothesis3_correlation_plot.png'))
-        plt.close()
\ No newline at end of file
+        plt.close()
+
+    def analyze_continuous(self, feature='RMSSD', window_seconds=300.0, step_seconds=30.0):
+        # Correlates every sensor with a sliding-window HRV feature over the whole session instead of phase means,
+        # both recordings are assumed to start together like in the raw data plots
+        correlations = {}
+        for temp_data, hrv_data in zip(self.all_temp_data, self.all_hrv_data):
+            features = hrv_data.get_sliding_features(window_seconds, step_seconds)
+            if features.empty:
+                print(f'Hypothesis3: {hrv_data.proband} is shorter than one {window_seconds:.0f} s window, skipped')
+                continue
+            temperatures = temp_data.get_dense_data().to_dataframe()
+            joined = join_hrv_features(temperatures, features[['TIMESTAMP', 'start_ms', 'end_ms', feature]])
+
+            for sensor in temp_data.temp_columns:
+                valid = joined[[sensor, feature]].dropna()
+                r = pearsonr(valid[sensor], valid[feature])[0] if len(valid) > 1 else np.nan
+                correlations[sensor] = correlations.get(sensor, []) + [r]
+
+        mean_correlations = {sensor: np.mean(r_values) for sensor, r_values in correlations.items()}
+        print(f'Hypothesis3: Mean correlations between {feature} and temperature over the whole session:')
+        print(mean_correlations)
+        return mean_correlations
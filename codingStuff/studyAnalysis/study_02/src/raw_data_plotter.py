@@ -24,7 +24,7 @@ class RawDataPlotter:
         for idx, (hrv_data, participant_subfolder) in enumerate(zip(self.all_hrv_data, participant_subfolders)):
             plt.figure(figsize=(10, 5), dpi=300)
 
-            timestamps_seconds = np.cumsum(hrv_data.hrv_df['RRIntervals'])
+            timestamps_seconds = hrv_data.beat_times
             timestamps_minutes = timestamps_seconds / 1000 / 60.0
 
             smoothed_RRIntervals = pd.Series(hrv_data.hrv_df['RRIntervals']).rolling(window=50).mean()
@@ -60,10 +60,11 @@ class RawDataPlotter:
             if proband not in self.phase_timestamps:
                 self.phase_timestamps[proband] = {}
 
-            for phase in temp_data.raw_data['ID'].unique():
+            for phase in temp_data.phase_index.phases:
                 # Get first and last timestamp for each phase
-                min_timestamp = temp_data.raw_data[temp_data.raw_data['ID'] == phase]['TIMESTAMP'].min()
-                max_timestamp = temp_data.raw_data[temp_data.raw_data['ID'] == phase]['TIMESTAMP'].max()
+                phase_timestamps = temp_data.get_phase_values('TIMESTAMP', phase)
+                min_timestamp = phase_timestamps.min()
+                max_timestamp = phase_timestamps.max()
 
                 # Calculate duration
                 duration = max_timestamp - min_timestamp
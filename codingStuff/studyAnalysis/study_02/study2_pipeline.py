@@ -1,5 +1,8 @@
 import os
 import pandas as pd
+from common.src.binary_log import select_log_files
+from common.src.log_cache import load_earable_log
+from common.src.parallel import map_ordered
 from study_02.src.TemperatureData import TemperatureData
 from study_02.src.hrv_data import HRVData
 from study_02.src.hrv_pipeline import HRVPipeline
@@ -12,10 +15,49 @@ from study_02.src.hypothesis4 import Hypothesis4Analyzer
 from study_02.src.raw_data_plotter import RawDataPlotter
 
 
+def load_participant(participant_path, ground_truth_temperature, hrv_timestamps, target_dir, calibration=None,
+                     motion_gating=False):
+    temp_file = select_log_files(os.listdir(participant_path))[0]
+    hrv_file = [f for f in os.listdir(participant_path) if f.endswith('.txt')][0]
+
+    temp_file_path = os.path.join(participant_path, temp_file)
+    hrv_file_path = os.path.join(participant_path, hrv_file)
+
+    # Process temperature data, zeros are replaced with NaN and temperatures scaled to °C by the loader
+    temp_columns = ['TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle']
+    temp_df = load_earable_log(temp_file_path, temp_columns)
+    if calibration is not None:
+        temp_df = calibration.apply_frame(temp_df, temp_columns)
+
+    # Process HRV data
+    timestamps = hrv_timestamps[os.path.basename(participant_path)]
+    hrv_df = pd.read_csv(hrv_file_path, header=None, names=['RRIntervals'])
+    hrv_data = HRVData(hrv_df, timestamps, os.path.dirname(hrv_file_path), os.path.basename(hrv_file_path))
+    # if os.path.basename(participant_path) == 'p04':
+    #     hrv_data.print_statistics()
+    # hrv_data.print_statistics()
+
+    temp_data = TemperatureData(
+        temp_df,
+        ground_truth_temperature[os.path.basename(participant_path)],
+        temp_columns,
+        os.path.basename(temp_file_path),
+        os.path.dirname(temp_file_path),
+        os.path.join(target_dir, os.path.basename(participant_path)),
+        scale_temperatures=False,
+        motion_gating=motion_gating
+    )
+    temp_data.smooth_data()
+    return temp_data, hrv_data
+
+
 class Study2Pipeline:
-    def __init__(self, data_dir, target_dir):
+    def __init__(self, data_dir, target_dir, num_workers=1, calibration=None, motion_gating=False):
         self.data_dir = data_dir
         self.target_dir = target_dir
+        self.num_workers = num_workers  # > 1 loads the participants in that many processes
+        self.calibration = calibration  # CalibrationModel applied to the temperatures at load time, None keeps them raw
+        self.motion_gating = motion_gating  # True drops the temperatures of samples with motion artifacts
         self.all_temp_data = []
         self.all_hrv_data = []
         self.ground_truth_temperature = {
@@ -69,40 +111,23 @@ class Study2Pipeline:
         }
 
     def process_directory(self):
+        jobs = []
         for participant_folder in os.listdir(self.data_dir):
             participant_path = os.path.join(self.data_dir, participant_folder)
             if os.path.isdir(participant_path):
-                self.process_participant(participant_path)
+                jobs.append((participant_path, self.ground_truth_temperature, self.hrv_timestamps, self.target_dir,
+                             self.calibration, self.motion_gating))
+
+        # Loading runs in the workers, plotting stays in this process
+        for temp_data, hrv_data in map_ordered(load_participant, jobs, self.num_workers):
+            temp_data.plot_raw_data()
+            self.all_temp_data.append(temp_data)
+            self.all_hrv_data.append(hrv_data)
 
     def process_participant(self, participant_path):
-        temp_file = [f for f in os.listdir(participant_path) if f.endswith('.csv')][0]
-        hrv_file = [f for f in os.listdir(participant_path) if f.endswith('.txt')][0]
-
-        temp_file_path = os.path.join(participant_path, temp_file)
-        hrv_file_path = os.path.join(participant_path, hrv_file)
-
-        # Process temperature data
-        temp_df = pd.read_csv(temp_file_path)
-        temp_columns = ['TympanicMembrane', 'Concha', 'EarCanal', 'Out_Bottom', 'Out_Top', 'Out_Middle']
-        temp_df[temp_columns] = temp_df[temp_columns].replace(0, np.nan)
-
-        # Process HRV data
-        timestamps = self.hrv_timestamps[os.path.basename(participant_path)]
-        hrv_df = pd.read_csv(hrv_file_path, header=None, names=['RRIntervals'])
-        hrv_data = HRVData(hrv_df, timestamps, os.path.dirname(hrv_file_path), os.path.basename(hrv_file_path))
-        # if os.path.basename(participant_path) == 'p04':
-        #     hrv_data.print_statistics()
-        # hrv_data.print_statistics()
-
-        temp_data = TemperatureData(
-            temp_df,
-            self.ground_truth_temperature[os.path.basename(participant_path)],
-            temp_columns,
-            os.path.basename(temp_file_path),
-            os.path.dirname(temp_file_path),
-            os.path.join(self.target_dir, os.path.basename(participant_path)),
-        )
-        temp_data.smooth_data()
+        temp_data, hrv_data = load_participant(participant_path, self.ground_truth_temperature,
+                                               self.hrv_timestamps, self.target_dir, self.calibration,
+                                               self.motion_gating)
         temp_data.plot_raw_data()
         self.all_temp_data.append(temp_data)
         self.all_hrv_data.append(hrv_data)
@@ -112,7 +137,7 @@ if __name__ == '__main__':
     data_dir = 'data/'
     target_dir = 'target/'
 
-    pipeline = Study2Pipeline(data_dir, target_dir)
+    pipeline = Study2Pipeline(data_dir, target_dir, num_workers=os.cpu_count())
     pipeline.process_directory()
 
     raw_data_plotter = RawDataPlotter(pipeline.all_temp_data, pipeline.all_hrv_data, data_dir, target_dir)